@@ -0,0 +1,150 @@
+import hashlib, threading, weakref
+from collections import OrderedDict
+
+# fingerprints are cached per frame object (by id) and dropped when the frame is collected
+_fingerprints = {}
+_fingerprint_lock = threading.Lock()
+
+
+def _forget(key):
+    with _fingerprint_lock:
+        _fingerprints.pop(key, None)
+
+
+def frame_fingerprint(df):
+    """
+    Cheap content fingerprint of a dataframe, computed once per frame object.
+    Hashes the column labels, dtypes, index and the row hashes of every block.
+    """
+    import numpy as np
+    import pandas as pd
+
+    key = id(df)
+    with _fingerprint_lock:
+        cached = _fingerprints.get(key)
+    if cached is not None:
+        return cached
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(list(df.columns)).encode())
+    digest.update(repr([str(dtype) for dtype in df.dtypes]).encode())
+    row_hashes = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    digest.update(np.ascontiguousarray(row_hashes).tobytes())
+    fingerprint = digest.hexdigest()
+
+    with _fingerprint_lock:
+        _fingerprints[key] = fingerprint
+    weakref.finalize(df, _forget, key)
+    return fingerprint
+
+
+def schema_signature(df):
+    """
+    Fingerprint of the column labels and dtypes only, shared by every version of a frame
+    whose values changed (e.g. after a forecast) but whose schema did not.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(
+        repr([(str(c), str(dtype)) for c, dtype in df.dtypes.items()]).encode()
+    )
+    return digest.hexdigest()
+
+
+def frame_nbytes(df):
+    """
+    Approximate resident size of a dataframe in bytes.
+    """
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class AgentPool:
+    def __init__(self, max_agents=8, max_bytes=None):
+        """
+        Bounded LRU pool of dataframe agents keyed by (model, fingerprint).
+        max_bytes caps the total size of the frames held by pooled agents.
+        """
+        self.max_agents = max_agents
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (agent, df, nbytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.building = {}  # key -> Event set once the agent being built is pooled
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        """
+        Returns the (agent, df) pair for the key or None, marking it as recently used.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def put(self, key, agent, df):
+        """
+        Adds an agent to the pool and evicts least recently used agents over the limits.
+        """
+        nbytes = frame_nbytes(df)
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[2]
+            self.entries[key] = (agent, df, nbytes)
+            self.nbytes += nbytes
+            self._evict()
+
+    def get_or_create(self, key, df, factory):
+        """
+        Returns the pooled agent for the key, creating it with factory(df) on a miss.
+        The agent is built outside the pool lock, so lookups of other keys are not blocked,
+        and concurrent callers asking for the same key wait for the one build.
+        """
+        while True:
+            with self.lock:
+                entry = self.get(key)
+                if entry is not None:
+                    return entry
+                building = self.building.get(key)
+                if building is None:
+                    building = self.building[key] = threading.Event()
+                    break
+            # built by another caller, or tried again here if that build failed
+            building.wait()
+        try:
+            agent = factory(df)
+            self.put(key, agent, df)
+            return agent, df
+        finally:
+            with self.lock:
+                del self.building[key]
+            building.set()
+
+    def _evict(self):
+        # always keep the most recently added agent, even if it alone exceeds the cap
+        while len(self.entries) > 1 and (
+            len(self.entries) > self.max_agents
+            or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+        ):
+            _, (_, _, nbytes) = self.entries.popitem(last=False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
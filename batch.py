@@ -0,0 +1,318 @@
+"""
+Runs a JSONL file of questions through IntentAgent, e.g. nightly report templates per store.
+
+    python batch.py questions.jsonl results.jsonl --rpm 500 --tpm 150000 --concurrency 8
+
+Each input line is {"id": optional, "user_input": str, "params": {...}}. params may hold "data"
+(csv path) and "data_type" to choose the frame, plus any IntentAgent.query params (features,
+use_cache, plan_mode, df_version). Results are appended to the output file as they finish, and
+rerunning the same command skips the ids already in it, except those that still failed with a
+transient error (time out or rate limit), whose last line in the file is the one that counts.
+"""
+
+import argparse, asyncio, json, os, time
+
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception_type,
+    retry_if_result,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+from response_cache import normalize_text
+from tracing import get_tracer
+
+# error responses of the agents that are worth retrying (rate limits, time outs, bad output)
+TRANSIENT_RESPONSES = {
+    "An unknown error occured. Please try again later.",
+    "An unknown error occurred. Please try again later.",
+    "The request timed out. Please try again later.",
+}
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute, tokens_per_minute, burst_seconds=10):
+        """
+        Token buckets for the model's requests and tokens per minute limits.
+        The rates are scaled down on every retry and recover slowly on success (AIMD), so the
+        scheduler settles just under the limits the API actually enforces.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.burst_seconds = burst_seconds
+        self.scale = 1.0
+        self.requests = self.capacity(requests_per_minute)
+        self.tokens = self.capacity(tokens_per_minute)
+        self.updated = time.monotonic()
+
+    def capacity(self, per_minute):
+        return per_minute * self.scale * self.burst_seconds / 60
+
+    def refill(self):
+        now = time.monotonic()
+        elapsed, self.updated = now - self.updated, now
+        self.requests = min(
+            self.capacity(self.requests_per_minute),
+            self.requests + elapsed * self.requests_per_minute * self.scale / 60,
+        )
+        self.tokens = min(
+            self.capacity(self.tokens_per_minute),
+            self.tokens + elapsed * self.tokens_per_minute * self.scale / 60,
+        )
+
+    async def acquire(self, requests, tokens):
+        """
+        Waits until the estimated requests and tokens of one query fit in both buckets.
+        A query larger than a bucket waits for it to fill up and then overdraws it.
+        """
+        while True:
+            self.refill()
+            need_requests = min(requests, self.capacity(self.requests_per_minute))
+            need_tokens = min(tokens, self.capacity(self.tokens_per_minute))
+            if self.requests >= need_requests and self.tokens >= need_tokens:
+                self.requests -= requests
+                self.tokens -= tokens
+                return
+            wait = max(
+                (need_requests - self.requests) / (self.requests_per_minute / 60),
+                (need_tokens - self.tokens) / (self.tokens_per_minute / 60),
+            )
+            await asyncio.sleep(wait / self.scale)
+
+    def backoff(self):
+        self.scale = max(self.scale / 2, 0.05)
+
+    def recover(self):
+        self.scale = min(self.scale + 0.02, 1.0)
+
+
+def llm_usage():
+    """
+    (tokens, LLM calls) recorded by the tracer so far in this process.
+    """
+    metrics = get_tracer().metrics
+    with metrics.lock:
+        tokens = sum(
+            value
+            for (name, _), value in metrics.counters.items()
+            if name == "tokens_total"
+        )
+        calls = sum(
+            histogram.count
+            for (name, labels), histogram in metrics.histograms.items()
+            if name == "span_duration_ms" and ("kind", "llm") in labels
+        )
+    return tokens, calls
+
+
+def is_transient(result):
+    return result.get("status") == 2 and result.get("response") in TRANSIENT_RESPONSES
+
+
+def read_records(path):
+    records = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                record = json.loads(line)
+                record.setdefault("id", line_number)
+                record.setdefault("params", {})
+                records.append(record)
+    return records
+
+
+def completed_ids(path):
+    """
+    Ids already answered in the output file by a previous (possibly interrupted) run.
+    Ids whose last result is still a transient error are left out so they are run again.
+    """
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path) as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+                if is_transient(row["result"]):
+                    done.discard(row["id"])
+                else:
+                    done.add(row["id"])
+            except (ValueError, KeyError, AttributeError):
+                continue  # a line cut off by the interruption
+    return done
+
+
+def query_key(record):
+    # identical questions (after normalization) with identical params are only run once
+    return json.dumps(
+        [normalize_text(record["user_input"]), record["params"]],
+        sort_keys=True,
+        default=str,
+    )
+
+
+class BatchRunner:
+    def __init__(
+        self,
+        limiter,
+        concurrency=8,
+        retries=4,
+        timeout=None,
+        gpt4=True,
+        data="./data/all_data.csv",
+        data_type="forModel",
+        tokens_per_query=4000,
+        requests_per_query=3,
+    ):
+        """
+        Runs the queries of a batch concurrently under the rate limiter.
+        tokens_per_query and requests_per_query are the initial estimates charged per query,
+        replaced by the averages measured by the tracer once a few queries have finished.
+        """
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+        self.gpt4 = gpt4
+        self.data = data
+        self.data_type = data_type
+        self.tokens_per_query = tokens_per_query
+        self.requests_per_query = requests_per_query
+        self.frames = {}
+        self.agents = {}
+        self.finished = 0
+        self.attempts = 0
+        self.usage_start = llm_usage()
+
+    def frame(self, params):
+        from data_loader import load_frame
+
+        key = (params.get("data", self.data), params.get("data_type", self.data_type))
+        if key not in self.frames:
+            self.frames[key] = load_frame(key[0], data_type=key[1])
+        return key, self.frames[key]
+
+    def agent(self, frame_key, params):
+        # one agent per frame and feature list, an IntentAgent holds the sub-agents of one session
+        from intent_agent import IntentAgent
+
+        key = (frame_key, json.dumps(params.get("features")))
+        if key not in self.agents:
+            self.agents[key] = IntentAgent(self.gpt4)
+        return self.agents[key]
+
+    def calibrate(self):
+        self.finished += 1
+        if self.finished < 3:
+            return
+        tokens, calls = llm_usage()
+        self.tokens_per_query = max((tokens - self.usage_start[0]) / self.finished, 1)
+        self.requests_per_query = max((calls - self.usage_start[1]) / self.finished, 1)
+
+    async def query_once(self, record):
+        self.attempts += 1
+        params = dict(record["params"])
+        frame_key, params["df"] = self.frame(params)
+        agent = self.agent(frame_key, params)
+        await self.limiter.acquire(self.requests_per_query, self.tokens_per_query)
+        return await agent.aquery(record["user_input"], params, self.timeout)
+
+    async def query(self, record):
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(self.retries),
+            wait=wait_random_exponential(multiplier=1, max=60),
+            retry=retry_if_result(is_transient) | retry_if_exception_type(Exception),
+            before_sleep=lambda retry_state: self.limiter.backoff(),
+            retry_error_callback=lambda retry_state: retry_state.outcome.result(),
+        )
+        start = time.perf_counter()
+        try:
+            result = await retrying(self.query_once, record)
+        except Exception as e:
+            result = {"status": 2, "response": f"{type(e).__name__}: {e}"}
+        if not is_transient(result):
+            self.limiter.recover()
+        self.calibrate()
+        return result, time.perf_counter() - start
+
+    async def run(self, records, output_path):
+        """
+        Runs the records that are not in output_path yet, appending each result as it finishes.
+        """
+        done = completed_ids(output_path)
+        groups = {}
+        for record in records:
+            if record["id"] not in done:
+                groups.setdefault(query_key(record), []).append(record)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_group(group):
+            async with semaphore:
+                return group, await self.query(group[0])
+
+        start = time.perf_counter()
+        written = failed = 0
+        with open(output_path, "a") as output:
+            for future in asyncio.as_completed(
+                [run_group(group) for group in groups.values()]
+            ):
+                group, (result, elapsed) = await future
+                failed += result.get("status") == 2
+                for record in group:
+                    row = {**record, "result": result, "elapsed_s": elapsed}
+                    output.write(json.dumps(row, default=str) + "\n")
+                    written += 1
+                output.flush()
+
+        elapsed = time.perf_counter() - start
+        tokens, calls = llm_usage()
+        return {
+            "records": len(records),
+            "skipped": len(done & {record["id"] for record in records}),
+            "written": written,
+            "unique_queries": len(groups),
+            "failed_queries": failed,
+            "attempts": self.attempts,
+            "elapsed_s": elapsed,
+            "throughput_qps": len(groups) / elapsed if elapsed else 0.0,
+            "llm_calls": calls - self.usage_start[1],
+            "tokens": tokens - self.usage_start[0],
+            "rate_scale": self.limiter.scale,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="JSONL file of {id, user_input, params} records")
+    parser.add_argument(
+        "output", help="JSONL results file, appended to and resumed from"
+    )
+    parser.add_argument("--data", default="./data/all_data.csv")
+    parser.add_argument("--data-type", default="forModel")
+    parser.add_argument("--rpm", type=float, default=500, help="requests per minute")
+    parser.add_argument("--tpm", type=float, default=150000, help="tokens per minute")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--retries", type=int, default=4, help="attempts per query")
+    parser.add_argument("--timeout", type=float, help="seconds per LLM call")
+    parser.add_argument(
+        "--gpt35", action="store_true", help="use gpt-3.5 instead of gpt-4"
+    )
+    args = parser.parse_args()
+
+    runner = BatchRunner(
+        RateLimiter(args.rpm, args.tpm),
+        concurrency=args.concurrency,
+        retries=args.retries,
+        timeout=args.timeout,
+        gpt4=not args.gpt35,
+        data=args.data,
+        data_type=args.data_type,
+    )
+    report = asyncio.run(runner.run(read_records(args.input), args.output))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""
+Offline benchmark for the query pipeline, run with a fake (or recorded) LLM backend.
+
+    python benchmark.py --rows 10000 100000 1000000 --output bench_results.json
+    python benchmark.py --compare bench_results.json
+"""
+
+import argparse, asyncio, json, os, platform, resource, subprocess, sys, tempfile, time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# representative questions per intent, taken from the examples in the agent prompts
+CORPUS = {
+    "forecast": [
+        "Increase inflation by 5%?",
+        "What happens if I increase average temperature?",
+        "What happens to sales if I increase discount by 0.0001?",
+        "Decrease price by 2?",
+        "Increase pepsi price by 10 and generate plots.",
+        "What happens to sales for mountain dew and coke if inflation decreases by 20%",
+    ],
+    "analysis": [
+        "What are the top selling items?",
+        "What is the dataframe about?",
+        "What products have the highest sales volume?",
+        "Which products yield highest profit margin?",
+        "What is the inventory turnover rate for high-margin products?",
+        "How do unit sales correlate with the level of discount offered?",
+        "What is the return on investment (ROI) for each product?",
+    ],
+    "simulation": [
+        "What is the best discount value to maximize revenue?",
+        "What is the optimum discount for the highest sales?",
+    ],
+    "conversation": [
+        "What can you do?",
+        "Can I ask you about the highest value items?",
+        "That is incorrect.",
+    ],
+    "error": ["How can I write mergesort?", "Write me a new df?"],
+}
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    values = np.asarray(samples) * 1000
+    return {
+        "n": len(values),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def scale_frame(df, rows, seed=0):
+    """
+    Synthetic frame with the schema of df and the given number of rows. Rows are
+    resampled and every copy of the original data is assigned to a new store_id.
+    """
+    rng = np.random.default_rng(seed)
+    scaled = df.iloc[rng.integers(0, len(df), rows)].reset_index(drop=True)
+    if "store_id" in scaled:
+        copies = np.arange(rows) // len(df)
+        scaled["store_id"] = scaled["store_id"].astype("int64") + copies
+    return scaled
+
+
+def install_backend(latency, recording):
+    from fake_llm import FakeChatModel
+    from llm import set_chat_model_factory
+
+    responses = {}
+    if recording:
+        with open(recording) as f:
+            responses = json.load(f)
+    set_chat_model_factory(
+        lambda name, temperature: FakeChatModel(
+            model_name=name, latency=latency, responses=responses
+        )
+    )
+
+
+def bench_load(csv_path, frames, tmpdir):
+    from data_loader import load_frame
+
+    results = {}
+    for rows, df in frames.items():
+        path = os.path.join(tmpdir, f"bench_{rows}.csv")
+        df.to_csv(path)
+        _, csv_time = timed(pd.read_csv, path, index_col=0)
+        _, convert_time = timed(load_frame, path)
+        _, load_time = timed(load_frame, path)
+        results[str(rows)] = {
+            "read_csv_s": csv_time,
+            "parquet_convert_s": convert_time,
+            "parquet_load_s": load_time,
+        }
+    return results
+
+
+# run in a fresh interpreter so nothing is already imported or compiled
+COLD_START_SCRIPT = """
+import time
+start = time.perf_counter()
+import intent_agent
+imported = time.perf_counter()
+intent_agent.IntentAgent()
+print(imported - start, time.perf_counter() - start)
+"""
+
+
+def bench_cold_start(budget, repeats):
+    """
+    Times importing intent_agent and building the first IntentAgent in a new process.
+    """
+    imports, first_agent = [], []
+    env = dict(os.environ, NAVSOFT_FAKE_LLM="1", NAVSOFT_CACHE="0")
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        import_time, total_time = map(float, output.split())
+        imports.append(import_time)
+        first_agent.append(total_time)
+    median = float(np.median(first_agent))
+    status = "ok" if median <= budget else "OVER BUDGET"
+    print(f"cold start {median:.3f}s (budget {budget:.3f}s): {status}")
+    return {
+        "import": percentiles(imports),
+        "first_agent": percentiles(first_agent),
+        "within_budget": median <= budget,
+    }
+
+
+def bench_construction(frames):
+    from dataframe_agent import DataframeAnalysisAgent
+
+    agent = DataframeAnalysisAgent()
+    results = {}
+    for rows, df in frames.items():
+        agent.materializations = None
+        _, build_time = timed(agent.build_agent, df)
+        results[str(rows)] = {"agent_build_s": build_time}
+    return results
+
+
+def check_snippet_isolation(df):
+    """
+    Checks that a variable set by the pandas code of one session's query is not seen by
+    another session, although both sessions use the same pooled agent.
+    """
+    from session import SessionManager
+
+    manager = SessionManager()
+    first, second = [
+        session.agent.get_analysis_agent(session.frame, session.df_key)
+        for session in (manager.create(df=df), manager.create(df=df))
+    ]
+    first.run_plan({"steps": [["python_repl_ast", "df = df.head(1); len(df)"]]})
+    results = second.run_plan({"steps": [["python_repl_ast", "len(df)"]]})
+    isolated = results is not None and results[0][2] == str(len(df))
+    print(f"snippet isolation: {'ok' if isolated else 'LEAKED'}")
+    return {"shared_agent": first.agent is second.agent, "isolated": isolated}
+
+
+def bench_memory(frames, tmpdir):
+    """
+    Peak traced memory of loading each frame and building an agent on it. Runs as its
+    own pass after the timed stages, since tracing every allocation slows everything it
+    covers.
+    """
+    import schema_summary
+    from data_loader import load_frame
+    from dataframe_agent import DataframeAnalysisAgent
+
+    agent = DataframeAnalysisAgent()
+    results = {}
+    tracemalloc.start()
+    for rows, df in frames.items():
+        path = os.path.join(tmpdir, f"memory_{rows}.csv")
+        df.to_csv(path)
+        tracemalloc.reset_peak()
+        load_frame(path)
+        _, load_peak = tracemalloc.get_traced_memory()
+        # build the schema summary again instead of taking it from the timed pass
+        schema_summary._summaries.clear()
+        schema_summary._profiles.clear()
+        agent.materializations = None
+        tracemalloc.reset_peak()
+        agent.build_agent(df)
+        _, build_peak = tracemalloc.get_traced_memory()
+        results[str(rows)] = {
+            "load_peak_mb": load_peak / 2**20,
+            "agent_build_peak_mb": build_peak / 2**20,
+        }
+    tracemalloc.stop()
+    return results
+
+
+def bench_stages(frames, repeats):
+    from intent_agent import IntentAgent
+
+    agent = IntentAgent()
+    results = {}
+    for rows, df in frames.items():
+        params = {"df": df, "use_cache": False}
+        stages = {"intent": [], "sub_agent": [], "end_to_end": []}
+        for _ in range(repeats):
+            for questions in CORPUS.values():
+                for question in questions:
+                    _, total = timed(agent.query, question, params)
+                    stages["end_to_end"].append(total)
+                    response_obj, intent_time = timed(
+                        agent.chain.invoke, {"user_input": question}
+                    )
+                    stages["intent"].append(intent_time)
+                    sub_agent, _ = agent.route(response_obj, params)
+                    if sub_agent is not None:
+                        _, sub_time = timed(sub_agent.query, question, use_cache=False)
+                        stages["sub_agent"].append(sub_time)
+        results[str(rows)] = {
+            name: percentiles(samples) for name, samples in stages.items()
+        }
+    return results
+
+
+def bench_concurrency(df, concurrency, total):
+    from intent_agent import IntentAgent
+
+    agent = IntentAgent()
+    questions = [q for questions in CORPUS.values() for q in questions]
+    params = {"df": df, "use_cache": False}
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(question):
+            async with semaphore:
+                start = time.perf_counter()
+                await agent.aquery(question, params)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[one(questions[i % len(questions)]) for i in range(total)]
+        )
+        return latencies, time.perf_counter() - start
+
+    latencies, elapsed = asyncio.run(run())
+    return {
+        "concurrency": concurrency,
+        "queries": total,
+        "throughput_qps": total / elapsed,
+        "latency": percentiles(latencies),
+    }
+
+
+def compare(current, baseline_path, threshold):
+    """
+    Prints metrics that got slower than the baseline by more than threshold
+    (fractional).
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def flatten(obj, prefix=""):
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                yield from flatten(value, f"{prefix}.{key}" if prefix else key)
+        elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+            yield prefix, obj
+
+    old = dict(flatten(baseline.get("results", {})))
+    regressions = 0
+    for name, value in flatten(current["results"]):
+        if name not in old or not old[name]:
+            continue
+        ratio = value / old[name]
+        higher_is_better = name.endswith("throughput_qps")
+        regressed = ratio < 1 - threshold if higher_is_better else ratio > 1 + threshold
+        if regressed and not name.endswith(".n"):
+            regressions += 1
+            print(f"REGRESSION {name}: {old[name]:.4g} -> {value:.4g} ({ratio:.2f}x)")
+    print(f"{regressions} regressions against {baseline_path}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data", default="./data/all_data.csv")
+    parser.add_argument("--rows", type=int, nargs="*", default=[10000, 100000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="fake LLM latency (s)"
+    )
+    parser.add_argument("--recording", help="json file of prompt substring -> reply")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--cold-start-budget", type=float, default=1.0, help="seconds")
+    args = parser.parse_args()
+
+    install_backend(args.latency, args.recording)
+
+    base, base_load_time = timed(pd.read_csv, args.data, index_col=0)
+    base = base[base["data_type"] == "forModel"]
+    frames = {len(base): base}
+    for rows in args.rows:
+        frames[rows] = scale_frame(base, rows)
+
+    results = {"base_read_csv_s": base_load_time}
+    results["cold_start"] = bench_cold_start(args.cold_start_budget, args.repeats)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results["load"] = bench_load(args.data, frames, tmpdir)
+    results["construction"] = bench_construction(frames)
+    results["snippet_isolation"] = check_snippet_isolation(base)
+    results["stages"] = bench_stages(frames, args.repeats)
+    results["concurrency"] = bench_concurrency(base, args.concurrency, args.queries)
+
+    # before the memory pass, whose tracing overhead would show up in the rss
+    results["memory"] = {
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results["memory"]["traced"] = bench_memory(frames, tmpdir)
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "args": vars(args),
+        "results": results,
+    }
+    print(json.dumps(results, indent=2))
+    if args.compare:
+        compare(report, args.compare, args.threshold)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
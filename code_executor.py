@@ -0,0 +1,478 @@
+"""
+Runs the pandas code written by the analysis agent in a pool of long lived worker processes.
+
+Each frame is written once as an Arrow IPC file (under /dev/shm when available) that every
+worker memory maps, so frames are never pickled per call. Snippets run with a CPU time, wall
+time and memory limit, and a worker that runs over is killed and replaced without affecting
+the serving process. Workers are started by running this file, so they do not import the
+caller's __main__ module the way multiprocessing's spawn does.
+"""
+
+import ast, atexit, os, resource, shutil, signal, socket, subprocess, sys, tempfile
+import threading, uuid
+from collections import OrderedDict
+from multiprocessing.connection import Connection
+from contextlib import redirect_stdout
+from io import StringIO
+
+from versioned_frame import VersionedFrame
+
+# run config metadata key of the namespace that keeps the variables of one query's snippets
+SNIPPET_NAMESPACE = "snippet_namespace"
+
+
+class CPUTimeLimitExceeded(Exception):
+    pass
+
+
+def _raise_cpu_limit(signum, frame):
+    raise CPUTimeLimitExceeded(
+        "the code used more CPU time than allowed and was stopped."
+    )
+
+
+def _load_frame(path, base=None):
+    """
+    Loads a frame file, or with base, a file of overlay columns applied on top of base.
+    """
+    if path.endswith(".pkl"):
+        import pandas as pd
+
+        df = pd.read_pickle(path)
+    else:
+        import pyarrow as pa
+
+        # the arrow buffers stay memory mapped, so workers share the pages of the file
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        df = table.to_pandas(split_blocks=True)
+    if base is None:
+        return df
+    overlay, df = df, base.copy(deep=False)
+    for column in overlay.columns:
+        df[column] = overlay[column]
+    return df
+
+
+def _execute(code, namespace):
+    """
+    Runs the snippet like langchain's PythonAstREPLTool, returning the value of the last
+    expression or whatever was printed.
+    """
+    tree = ast.parse(code)
+    exec(ast.unparse(ast.Module(tree.body[:-1], type_ignores=[])), namespace)
+    last = ast.unparse(ast.Module(tree.body[-1:], type_ignores=[]))
+    buffer = StringIO()
+    try:
+        with redirect_stdout(buffer):
+            value = eval(last, namespace)
+    except Exception:
+        with redirect_stdout(buffer):
+            exec(last, namespace)
+        return buffer.getvalue()
+    return buffer.getvalue() if value is None else value
+
+
+def _cpu_used():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _touch(cache, key, max_size, create):
+    """
+    LRU lookup used by the workers and by the pool's mirror of their caches, so both evict
+    the same keys. Returns (value, evicted keys).
+    """
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key], []
+    cache[key] = create()
+    evicted = []
+    while len(cache) > max_size:
+        evicted.append(cache.popitem(last=False)[0])
+    return cache[key], evicted
+
+
+def _cached_frame(frames, key, path, max_frames, load):
+    """
+    Returns the frame from the LRU cache, loading it with load(path, base) on a miss.
+    A version of a frame, path (base key, base path, overlay path), is built on the cached
+    base, so every version shares the base columns converted once.
+    """
+
+    def create():
+        if isinstance(path, tuple):
+            base_key, base_path, overlay_path = path
+            base = _cached_frame(frames, base_key, base_path, max_frames, load)
+            return load(overlay_path, base)
+        return load(path, None)
+
+    return _touch(frames, key, max_frames, create)[0]
+
+
+def _worker_main(conn, memory_bytes, max_frames, max_namespaces):
+    import pandas as pd
+
+    # each namespace gets a shallow copy of the loaded frame, copy on write keeps in place
+    # changes made by one query's code out of the frame seen by the others
+    pd.set_option("mode.copy_on_write", True)
+    if memory_bytes:
+        # unlike RLIMIT_AS this leaves out the memory mapped frame files
+        resource.setrlimit(resource.RLIMIT_DATA, (memory_bytes, memory_bytes))
+    signal.signal(signal.SIGXCPU, _raise_cpu_limit)
+    _, cpu_hard = resource.getrlimit(resource.RLIMIT_CPU)
+    frames = OrderedDict()  # frame key -> loaded frame
+    # (namespace, frame key) -> variables of the snippets of one query on that frame
+    namespaces = OrderedDict()
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        namespace, key, path, code, cpu_seconds, max_output = message
+        try:
+            df = _cached_frame(frames, key, path, max_frames, _load_frame)
+            if namespace is None:
+                variables = {"df": df.copy(deep=False)}
+            else:
+                variables, _ = _touch(
+                    namespaces,
+                    (namespace, key),
+                    max_namespaces,
+                    lambda: {"df": df.copy(deep=False)},
+                )
+            if cpu_seconds:
+                limit = int(_cpu_used() + cpu_seconds) + 1
+                resource.setrlimit(resource.RLIMIT_CPU, (limit, cpu_hard))
+            output = str(_execute(code, variables))
+        except BaseException as e:
+            output = f"{type(e).__name__}: {e}"
+        finally:
+            if cpu_seconds:
+                resource.setrlimit(resource.RLIMIT_CPU, (cpu_hard, cpu_hard))
+        if len(output) > max_output:
+            output = output[:max_output] + "\n... (output truncated)"
+        conn.send(output)
+
+
+class Worker:
+    def __init__(self, memory_bytes, max_frames, max_namespaces):
+        parent_socket, child_socket = socket.socketpair()
+        fd = child_socket.fileno()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(fd)]
+            + [str(memory_bytes or 0), str(max_frames), str(max_namespaces)],
+            pass_fds=(fd,),
+            stdin=subprocess.DEVNULL,
+        )
+        child_socket.close()
+        self.conn = Connection(parent_socket.detach())
+        # mirrors of the worker's frame and namespace caches
+        self.frames = OrderedDict()
+        self.namespaces = OrderedDict()
+        self.max_frames = max_frames
+        self.max_namespaces = max_namespaces
+
+    def loaded(self, namespace, key, path):
+        """
+        Records a finished call, returns the namespaces the worker dropped.
+        """
+        _cached_frame(self.frames, key, path, self.max_frames, lambda *args: True)
+        if namespace is None:
+            return []
+        _, evicted = _touch(
+            self.namespaces, (namespace, key), self.max_namespaces, lambda: True
+        )
+        return evicted
+
+    def stop(self, timeout=1):
+        try:
+            self.conn.send(None)
+            self.process.wait(timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+        self.conn.close()
+
+
+class CodeExecutionPool:
+    def __init__(
+        self,
+        max_workers=None,
+        timeout=30,
+        cpu_seconds=20,
+        memory_mb=2048,
+        max_frames=16,
+        max_namespaces=64,
+        max_output=10000,
+    ):
+        """
+        Pool of worker processes that run agent generated code against shared frames.
+        Workers are started on first use. timeout is the wall time per snippet (seconds),
+        cpu_seconds and memory_mb the CPU time and memory limits of a worker (None for no
+        limit, memory mapped frames do not count), max_frames the number of frames kept per
+        worker and max_namespaces the number of query namespaces kept per worker.
+        Snippets of the same namespace share their variables, and their calls always go to the
+        worker that holds them.
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = int(memory_mb * 1024 * 1024) if memory_mb else None
+        self.max_frames = max_frames
+        self.max_namespaces = max_namespaces
+        self.max_output = max_output
+        self.directory = None
+        self.frames = OrderedDict()  # key -> path of the shared frame file
+        self.owners = {}  # (namespace, frame key) -> worker holding the namespace
+        self.idle = []
+        self.started = 0
+        self.runs = 0
+        self.failures = 0
+        self.lock = threading.RLock()
+        self.condition = threading.Condition(self.lock)
+
+    def register(self, key, df):
+        """
+        Writes the frame for the workers once and returns its path.
+        A VersionedFrame is written as its base frame and a file with only its overlay columns,
+        returned as (base version, base path, overlay path), so the versions of a frame share
+        one copy of the unchanged columns.
+        """
+        if isinstance(df, VersionedFrame):
+            base_path = self.register(df.base_version, df.base)
+            if not df.overlays:
+                return base_path
+            overlay_path = self.register(key, df.df[list(df.overlays)])
+            return df.base_version, base_path, overlay_path
+        with self.lock:
+            path = self.frames.get(key)
+            if path is not None:
+                self.frames.move_to_end(key)
+                return path
+            if self.directory is None:
+                base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+                self.directory = tempfile.mkdtemp(prefix="navsoft-frames-", dir=base)
+
+        import pyarrow as pa
+
+        path = os.path.join(self.directory, f"{key}.arrow")
+        tmp_path = os.path.join(self.directory, f"{uuid.uuid4().hex}.tmp")
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=True)
+            with pa.OSFile(tmp_path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            # columns arrow cannot represent, e.g. mixed python objects
+            path = os.path.join(self.directory, f"{key}.pkl")
+            df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.frames[key] = path
+            while len(self.frames) > self.max_frames:
+                # workers that still map the file keep their copy until they drop the frame
+                _, old_path = self.frames.popitem(last=False)
+                os.remove(old_path)
+        return path
+
+    def _acquire(self, namespace, key):
+        with self.condition:
+            while True:
+                owner = self.owners.get((namespace, key))
+                if owner is not None:
+                    # the namespace's variables only exist in its worker
+                    if owner in self.idle:
+                        self.idle.remove(owner)
+                        return owner
+                    self.condition.wait()
+                    continue
+                # prefer a worker that already has the frame loaded
+                for i, worker in enumerate(self.idle):
+                    if key in worker.frames:
+                        return self.idle.pop(i)
+                if self.idle:
+                    return self.idle.pop()
+                if self.started < self.max_workers:
+                    self.started += 1
+                    break
+                self.condition.wait()
+        try:
+            return Worker(self.memory_bytes, self.max_frames, self.max_namespaces)
+        except BaseException:
+            with self.condition:
+                self.started -= 1
+                self.condition.notify_all()
+            raise
+
+    def _release(self, worker, namespace, key, path):
+        with self.condition:
+            for evicted in worker.loaded(namespace, key, path):
+                self.owners.pop(evicted, None)
+            if namespace is not None:
+                self.owners[(namespace, key)] = worker
+            self.idle.append(worker)
+            self.condition.notify_all()
+
+    def _discard(self, worker):
+        worker.kill()
+        with self.condition:
+            self.owners = {k: w for k, w in self.owners.items() if w is not worker}
+            self.started -= 1
+            self.failures += 1
+            self.condition.notify_all()
+
+    def run(self, key, df, code, timeout=None, namespace=None):
+        """
+        Runs code with df bound to the frame registered under key and returns its output.
+        Variables are kept between the calls with the same namespace, without one every call
+        starts from a fresh copy of the frame.
+        Errors, time outs and crashed workers are returned as text for the agent to read.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        path = self.register(key, df)
+        worker = self._acquire(namespace, key)
+        try:
+            message = (namespace, key, path, code, self.cpu_seconds, self.max_output)
+            worker.conn.send(message)
+            if not worker.conn.poll(timeout):
+                self._discard(worker)
+                return f"TimeoutError: the code took longer than {timeout}s and was stopped."
+            output = worker.conn.recv()
+        except (EOFError, OSError):
+            self._discard(worker)
+            return "WorkerError: the code execution worker exited, e.g. by running out of memory."
+        except BaseException:
+            self._discard(worker)
+            raise
+        self._release(worker, namespace, key, path)
+        with self.lock:
+            self.runs += 1
+        return output
+
+    def as_tool(self, df):
+        """
+        Drop-in replacement for the python_repl_ast tool of the pandas agent that runs the
+        code in the pool instead of the serving process. df may be a VersionedFrame.
+        The tool is shared by every query on the frame, so variables are kept per query:
+        runs whose config carries snippet_metadata() share them, other calls start from a
+        fresh copy of the frame.
+        """
+        key = df.version if isinstance(df, VersionedFrame) else uuid.uuid4().hex
+
+        def run(query, namespace):
+            return self.run(key, df, query, namespace=namespace)
+
+        return _repl_tool(run)
+
+    def shutdown(self):
+        with self.condition:
+            workers, self.idle = self.idle, []
+            self.started -= len(workers)
+            self.owners = {k: w for k, w in self.owners.items() if w not in workers}
+            for worker in workers:
+                worker.stop()
+            if self.directory is not None:
+                shutil.rmtree(self.directory, ignore_errors=True)
+                self.directory = None
+                self.frames.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.started,
+                "idle": len(self.idle),
+                "frames": len(self.frames),
+                "runs": self.runs,
+                "failures": self.failures,
+            }
+
+
+def snippet_metadata():
+    """
+    Run config metadata giving the python tool calls of one query their own variables.
+    """
+    return {SNIPPET_NAMESPACE: uuid.uuid4().hex}
+
+
+def _repl_tool(run):
+    """
+    python_repl_ast tool calling run(code, namespace), with the namespace of the query.
+    """
+    from langchain_core.tools import Tool
+    from langchain_experimental.tools.python.tool import (
+        PythonAstREPLTool,
+        PythonInputs,
+        sanitize_input,
+    )
+
+    def func(query, callbacks=None):
+        metadata = getattr(callbacks, "metadata", None) or {}
+        return run(sanitize_input(query), metadata.get(SNIPPET_NAMESPACE))
+
+    return Tool(
+        name=PythonAstREPLTool.__fields__["name"].default,
+        description=PythonAstREPLTool.__fields__["description"].default,
+        func=func,
+        args_schema=PythonInputs,
+    )
+
+
+def local_tool(df, max_namespaces=64):
+    """
+    In process counterpart of CodeExecutionPool.as_tool, used when the pool is disabled.
+    Keeps the variables per query the same way, without the limits of the workers.
+    """
+    from langchain_experimental.tools.python.tool import PythonAstREPLTool
+
+    if isinstance(df, VersionedFrame):
+        df = df.df
+    namespaces = OrderedDict()  # namespace -> tool holding its variables
+    lock = threading.Lock()
+
+    def create():
+        return PythonAstREPLTool(locals={"df": df.copy(deep=False)})
+
+    def run(query, namespace):
+        if namespace is None:
+            tool = create()
+        else:
+            with lock:
+                tool, _ = _touch(namespaces, namespace, max_namespaces, create)
+        return tool.run(query)
+
+    return _repl_tool(run)
+
+
+def _env_limit(name, default):
+    value = os.environ.get(name, default)
+    return float(value) if value not in (None, "", "0") else None
+
+
+# NAVSOFT_EXEC_WORKERS=0 keeps running the agent code in process
+code_pool = (
+    CodeExecutionPool(
+        max_workers=int(os.environ.get("NAVSOFT_EXEC_WORKERS", 0)) or None,
+        timeout=float(os.environ.get("NAVSOFT_EXEC_TIMEOUT", 30)),
+        cpu_seconds=_env_limit("NAVSOFT_EXEC_CPU_SECONDS", 20),
+        memory_mb=_env_limit("NAVSOFT_EXEC_MEMORY_MB", 2048),
+    )
+    if os.environ.get("NAVSOFT_EXEC_WORKERS") != "0"
+    else None
+)
+if code_pool is not None:
+    atexit.register(code_pool.shutdown)
+
+
+if __name__ == "__main__":
+    # started by Worker: python code_executor.py fd memory_bytes max_frames max_namespaces
+    fd, memory_bytes, max_frames, max_namespaces = map(int, sys.argv[1:])
+    _worker_main(Connection(fd), memory_bytes, max_frames, max_namespaces)
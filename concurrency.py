@@ -0,0 +1,63 @@
+import asyncio, os, weakref
+
+
+class QueryLimiter:
+    def __init__(self, max_concurrency=16, timeout=None):
+        """
+        Caps the number of LLM calls in flight per process and applies a per-call timeout.
+        """
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.semaphores = weakref.WeakKeyDictionary()  # one semaphore per event loop
+
+    def semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self.semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.semaphores[loop] = semaphore
+        return semaphore
+
+    async def run(self, make_call, timeout=None):
+        """
+        Awaits make_call() once a slot is free. Raises asyncio.TimeoutError if it takes too long,
+        cancelling the underlying call.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        async with self.semaphore():
+            return await asyncio.wait_for(make_call(), timeout)
+
+    async def stream(self, make_stream, timeout=None):
+        """
+        Iterates the async iterator make_stream() while holding a slot for the whole stream.
+        Raises asyncio.TimeoutError if the stream takes longer than timeout in total, closing
+        the underlying stream.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        async with self.semaphore():
+            stream = make_stream()
+            try:
+                while True:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = max(deadline - loop.time(), 0)
+                    try:
+                        item = await asyncio.wait_for(stream.__anext__(), remaining)
+                    except StopAsyncIteration:
+                        return
+                    yield item
+            finally:
+                if hasattr(stream, "aclose"):
+                    await stream.aclose()
+
+
+query_limiter = QueryLimiter(
+    max_concurrency=int(os.environ.get("NAVSOFT_MAX_CONCURRENT_QUERIES", 16)),
+    timeout=(
+        float(os.environ["NAVSOFT_QUERY_TIMEOUT"])
+        if "NAVSOFT_QUERY_TIMEOUT" in os.environ
+        else None
+    ),
+)
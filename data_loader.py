@@ -0,0 +1,180 @@
+import os, shutil
+
+import numpy as np
+import pandas as pd
+
+# explicit schema for the exported sales data, columns missing from a file are skipped
+DATE_COLUMNS = ["date"]
+CATEGORICAL_COLUMNS = [
+    "ItemName",
+    "Description",
+    "BrandName",
+    "product_category",
+    "company",
+    "size_name",
+    "company_full_name",
+    "street",
+    "city",
+    "state",
+    "state_code",
+    "data_type",
+]
+INTEGER_COLUMNS = [
+    "Item_id",
+    "product_upc",
+    "store_id",
+    "size_description",
+    "QuantityInCase",
+    "total_transactions",
+    "month",
+    "day",
+    "year",
+    "month_number",
+    "week_number",
+    "total_weeks_on_sale",
+]
+# measurements where float32 precision is plenty, money columns stay float64
+FLOAT32_COLUMNS = [
+    "zipcode",
+    "average_temperature",
+    "tmin",
+    "tmax",
+    "precipitation",
+    "average_snow",
+    "wdir",
+    "wspd",
+    "wpgt",
+    "pres",
+    "tsun",
+]
+INDEX_COLUMN = "row_id"
+# integer columns are stored no narrower than this, the agents compute with them
+# (e.g. year * 100 + week_number) and narrower types overflow silently
+MIN_INTEGER_DTYPE = "int32"
+
+
+def widen_integers(df):
+    """
+    Casts the integer columns narrower than MIN_INTEGER_DTYPE up to it, e.g. in datasets
+    converted by older versions that downcast to int8.
+    """
+    minimum = np.dtype(MIN_INTEGER_DTYPE)
+    for column in INTEGER_COLUMNS:
+        if column in df and df[column].dtype.kind in "iu":
+            if df[column].dtype.itemsize < minimum.itemsize:
+                df[column] = df[column].astype(minimum)
+    return df
+
+
+def default_dataset_path(csv_path):
+    return os.path.splitext(csv_path)[0] + ".parquet"
+
+
+def read_csv_typed(csv_path):
+    """
+    Reads the raw CSV export with the explicit schema applied.
+    """
+    df = pd.read_csv(
+        csv_path,
+        index_col=0,
+        parse_dates=DATE_COLUMNS,
+        dtype={column: "category" for column in CATEGORICAL_COLUMNS},
+    )
+    df.index.name = INDEX_COLUMN
+    for column in INTEGER_COLUMNS:
+        if column in df and df[column].notna().all():
+            values = df[column]
+            fits = values.min() >= np.iinfo(MIN_INTEGER_DTYPE).min and (
+                values.max() <= np.iinfo(MIN_INTEGER_DTYPE).max
+            )
+            df[column] = values.astype(MIN_INTEGER_DTYPE if fits else "int64")
+    for column in FLOAT32_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype("float32")
+    return df.reset_index()
+
+
+def convert_csv(csv_path, dataset_path=None, partition_cols=("data_type",)):
+    """
+    Converts the CSV export once into a hive partitioned Parquet dataset.
+    Pass e.g. partition_cols=("data_type", "year", "store_id") for larger exports.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    dataset_path = dataset_path or default_dataset_path(csv_path)
+    table = pa.Table.from_pandas(read_csv_typed(csv_path), preserve_index=False)
+    if os.path.exists(dataset_path):
+        shutil.rmtree(dataset_path)
+    pq.write_to_dataset(table, dataset_path, partition_cols=list(partition_cols))
+    return dataset_path
+
+
+def build_filter(filters):
+    """
+    Builds a pyarrow filter expression from {column: value or list of values}.
+    """
+    import pyarrow.dataset as ds
+
+    expression = None
+    for column, value in filters.items():
+        if isinstance(value, (list, tuple, set)):
+            condition = ds.field(column).isin(list(value))
+        else:
+            condition = ds.field(column) == value
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def load_frame(
+    csv_path="./data/all_data.csv",
+    data_type="forModel",
+    columns=None,
+    filters=None,
+    dataset_path=None,
+    partition_cols=("data_type",),
+):
+    """
+    Loads the sales data from the Parquet dataset, (re)building it from the CSV when the
+    CSV is newer. Filters and column projection are pushed down into the read, so only the
+    matching partitions, row groups and columns are memory-mapped and decoded.
+    """
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+
+    dataset_path = dataset_path or default_dataset_path(csv_path)
+    if not os.path.exists(dataset_path) or (
+        os.path.exists(csv_path)
+        and os.path.getmtime(csv_path) > os.path.getmtime(dataset_path)
+    ):
+        convert_csv(csv_path, dataset_path, partition_cols)
+
+    dataset = ds.dataset(
+        dataset_path,
+        format="parquet",
+        partitioning="hive",
+        filesystem=pafs.LocalFileSystem(use_mmap=True),
+    )
+    filters = dict(filters or {})
+    if data_type is not None:
+        filters["data_type"] = data_type
+    if columns is not None:
+        columns = [INDEX_COLUMN] + [c for c in columns if c != INDEX_COLUMN]
+
+    table = dataset.to_table(
+        columns=columns, filter=build_filter(filters) if filters else None
+    )
+    df = table.to_pandas()
+    # partition columns come back as plain strings at the end of the frame
+    for column in partition_cols:
+        if column in df and column in CATEGORICAL_COLUMNS:
+            df[column] = df[column].astype("category")
+    widen_integers(df)
+    metadata = dataset.schema.pandas_metadata
+    if metadata is not None:
+        order = [c["name"] for c in metadata["columns"] if c["name"] in df]
+        df = df[order + [c for c in df.columns if c not in order]]
+    if INDEX_COLUMN in df:
+        df = df.set_index(INDEX_COLUMN).sort_index()
+        df.index.name = None
+    return df
@@ -1,21 +1,47 @@
-import os, logging
-import secret
+import asyncio, os, logging, re
 from datetime import datetime
+from agent_pool import AgentPool, schema_signature
+from code_executor import code_pool, local_tool, snippet_metadata
+from concurrency import query_limiter
+from llm import get_chat_model, get_compiled, model_name
+from response_cache import get_default_cache
+from schema_summary import get_summary
+from streaming import aresponse_deltas, astream_run, response_deltas, stream_run
+from tracing import trace_config
+from versioned_frame import as_versioned
 
 # langchain imports
-from langchain.agents.agent_types import AgentType
-from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
+from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.pydantic_v1 import BaseModel, Field
 
-
-os.environ["OPENAI_API_KEY"] = secret.OPENAI_KEY
 logging.basicConfig(
     filename="agent_errors.txt", encoding="utf-8", level=logging.WARNING
 )
 
+# bump whenever the prompt changes so cached responses are invalidated
+PROMPT_VERSION = 4
+
+# tokens of the frame summary put in the agent's system prompt in place of df.head()
+SCHEMA_TOKENS = int(os.environ.get("NAVSOFT_SCHEMA_TOKENS", 800))
+
+# how recorded plans are used: "phrase" replays the code and has the LLM phrase the results,
+# "numbers" returns the raw results without calling the LLM, "off" always runs the agent
+PLAN_MODE = os.environ.get("NAVSOFT_PLAN_MODE", "phrase")
+
+# errors are returned as "<ExceptionName>: <message>" by the python tools
+TOOL_ERROR_RE = re.compile(r"^[A-Z]\w*(Error|Exception|Exceeded|Interrupt):")
+
+# agents shared by every DataframeAnalysisAgent, keyed by model and frame fingerprint
+agent_pool = AgentPool(
+    max_agents=int(os.environ.get("NAVSOFT_AGENT_POOL_SIZE", 8)),
+    max_bytes=(
+        int(os.environ["NAVSOFT_AGENT_POOL_MB"]) * 1024 * 1024
+        if "NAVSOFT_AGENT_POOL_MB" in os.environ
+        else None
+    ),
+)
+
 
 class Analysis(BaseModel):
     status: int = Field(
@@ -27,47 +53,107 @@ class Analysis(BaseModel):
 
 
 class DataframeAnalysisAgent(object):
-    def __new__(cls, df=None, gpt4=True):
+    def __init__(self, df=None, gpt4=True, version=None, plan_mode=None):
         """
-        DataframeAnalysisAgent is a singleton class so that we can avoid recreating agents
+        Analysis agent for one session. The underlying pandas agents are shared through
+        agent_pool, so creating an instance per session is cheap.
         Use load_new_df to make any changes to the df and agent
         """
-        if not hasattr(cls, "instance"):
-            cls.instance = super(DataframeAnalysisAgent, cls).__new__(cls)
-        return cls.instance
-
-    def __init__(self, df=None, gpt4=True):
-        self.model = "gpt-4-0125-preview" if gpt4 else "gpt-3.5-turbo-1106"
+        self.model = model_name(gpt4)
+        self.plan_mode = plan_mode or PLAN_MODE
         self.parser = JsonOutputParser(pydantic_object=Analysis)
+        self.cache = get_default_cache()
         if df is not None:
-            self.load_new_df(df)
+            self.load_new_df(df, version)
 
-    def create_agent(self, temp=0.0):
+    def create_agent(self, df, temp=0.0, materializations=None, version=None):
         """
-        Create chat agent with given df and model.
+        Create chat agent with given df (a DataFrame or VersionedFrame) and model.
+        The prompt describes the frame with a token budgeted schema summary instead of its
+        first rows. The precomputed analytics views are added as extra tools, and the generated
+        pandas code runs in the worker processes of code_pool unless NAVSOFT_EXEC_WORKERS=0.
+        The agent is pooled, so its code tool keeps variables per query (see query_config).
         """
+        # imported lazily, langchain.agents dominates the import time of this module
+        from langchain.agents.agent_types import AgentType
+        from langchain_experimental.agents.agent_toolkits import (
+            create_pandas_dataframe_agent,
+        )
+
+        from langchain_experimental.agents.agent_toolkits.pandas.prompt import (
+            PREFIX_FUNCTIONS,
+        )
+
+        frame = as_versioned(df, version)
+        summary = get_summary(
+            frame.version,
+            frame.df,
+            SCHEMA_TOKENS,
+            self.model,
+            column_keys=frame.column_keys(),
+        )
         agent = create_pandas_dataframe_agent(
-            ChatOpenAI(temperature=temp, model=self.model),
-            self.df,
+            get_chat_model(self.model, temperature=temp, streaming=True),
+            frame.df,
+            prefix=f"{PREFIX_FUNCTIONS}\n\n{summary}",
+            include_df_in_prompt=False,
             verbose=False,  # set to true if debugging
             agent_type=AgentType.OPENAI_FUNCTIONS,
+            return_intermediate_steps=True,  # recorded as plans
+            extra_tools=materializations.as_tools() if materializations else (),
+        )
+        repl_tool = (
+            code_pool.as_tool(frame) if code_pool is not None else local_tool(frame)
         )
+        for tools in (agent.tools, agent.agent.tools):
+            tools[:] = [repl_tool if t.name == repl_tool.name else t for t in tools]
         return agent
 
-    def load_new_df(self, df):
+    def build_agent(self, df, version=None, changed_columns=None):
         """
-        Function to add new dataframe and update agent
+        Builds the pooled (agent, materializations) pair for a frame. When the frame is a new
+        version of the one currently loaded, only views over the changed columns are rebuilt.
         """
-        if not hasattr(self, "df") or not self.df.equals(df):
-            self.df = df
-            self.agent = self.create_agent(0.1)
+        from materializations import AnalyticsMaterializations
+
+        frame = as_versioned(df, version)
+        previous = getattr(self, "materializations", None)
+        if previous is None:
+            materializations = AnalyticsMaterializations(frame.df)
+        else:
+            materializations = previous.derive(frame.df, changed_columns)
+        agent = self.create_agent(frame, 0.1, materializations)
+        return agent, materializations
 
-    def query(self, user_prompt):
+    def load_new_df(self, df, version=None):
         """
-        Runs the query against the agent and returns response (or appropriate error)
+        Function to add new dataframe and update agent.
+        Agents are pooled by frame fingerprint, or by the caller supplied version token,
+        so switching between previously loaded frames never rebuilds an agent.
+        A VersionedFrame is identified by its version, and a new version of the loaded frame
+        only rebuilds what depends on the columns it replaced.
         """
+        frame = as_versioned(df, version)
+        key = (self.model, frame.version)
+        if getattr(self, "key", None) == key:
+            return
+        changed_columns = frame.changed_columns(getattr(self, "frame", None))
+        (self.agent, self.materializations), self.df = agent_pool.get_or_create(
+            key, frame.df, lambda df: self.build_agent(frame, None, changed_columns)
+        )
+        self.frame = frame
+        self.key = key
+        self.schema = schema_signature(self.df)
 
-        prompt_template = PromptTemplate(
+    def format_prompt(self, user_prompt):
+        """
+        Wraps the user request in the analysis instructions for the agent.
+        """
+        prompt_template = get_compiled(("analysis_prompt",), self.build_prompt)
+        return prompt_template.format(query=user_prompt)
+
+    def build_prompt(self):
+        return PromptTemplate(
             template="""You are a helpful data analyst that will solve the provided user request using the dataframe appropriately.
 
             It is important that you answer accurately. If you do not understand the question, or cannot answer it, be clear and ask for clarifications. Remember that you should only answer questions about the dataframe. 
@@ -81,6 +167,8 @@ class DataframeAnalysisAgent(object):
             Eg: user_input: How do unit sales correlate with the level of discount offered? approach: Perform regression analysis to understand the correlation between discount levels and unit sales.
             Eg: user_input: What is the return on investment (ROI) for each product? approach: combine margin data with investment costs for each product to compute ROI and return in the response, don't consider the product categories themselves, only specific products.
             
+            If one of the precomputed analytics tools (top_sellers, store_sales, weekly_sales, margin_ranking, roi, discount_regression) answers the request, call it instead of writing pandas code.
+
             If a user request pertains to something apart from the dataframe, reply saying that the query is out of your domain.
             
             \n{format_instructions}\n{query}
@@ -100,17 +188,385 @@ class DataframeAnalysisAgent(object):
             },
         )
 
+    def build_phrase_chain(self):
+        prompt = PromptTemplate(
+            template="""You are a helpful data analyst. The user request below has already been answered by running these steps against the dataframe:
+
+            {results}
+
+            Using only these results, write the response to the user request. Do not calculate or make up any other numbers.
+            \n{format_instructions}\n{query}
+
+            You must strictly adhere to the given format with the JSON object of response and status.
+            Your response field must be a string in markdown format. If the results contain a table or a list, make sure you leverage the markdown tools for formatting data in that manner.
+            If you use latex for any equations in your markdown response string, use double backslashes to avoid any JSON encoding errors.
+            """,
+            input_variables=["results", "query"],
+            partial_variables={
+                "format_instructions": self.parser.get_format_instructions()
+            },
+        )
+        model = get_chat_model(self.model, temperature=0.1, streaming=True)
+        return prompt | model | self.parser
+
+    def phrase_chain(self):
+        return get_compiled(
+            ("analysis_phrase_chain", self.model), self.build_phrase_chain
+        )
+
+    def plan_key(self, user_prompt):
+        # plans depend on the columns and dtypes only, so they carry over to new versions of a frame
+        return self.cache.make_key(
+            "plan", user_prompt, self.model, PROMPT_VERSION, fingerprint=self.schema
+        )
+
+    def get_plan(self, user_prompt, use_cache=True, plan_mode=None):
+        if (plan_mode or self.plan_mode) == "off":
+            return None
+        return self.cache.get(self.plan_key(user_prompt), bypass=not use_cache)
+
+    def record_plan(
+        self, user_prompt, response, response_obj, use_cache=True, plan_mode=None
+    ):
+        """
+        Stores the tool calls of a successful agent run as the plan for the question.
+        Calls that failed are left out.
+        """
+        if (plan_mode or self.plan_mode) == "off" or response_obj.get("status") != 0:
+            return
+        tool_names = {tool.name for tool in self.agent.tools}
+        steps = [
+            [action.tool, action.tool_input]
+            for action, observation in response.get("intermediate_steps", [])
+            if action.tool in tool_names and not TOOL_ERROR_RE.match(str(observation))
+        ]
+        if steps:
+            plan = {"steps": steps}
+            self.cache.put(self.plan_key(user_prompt), plan, bypass=not use_cache)
+
+    def run_plan(self, plan):
+        """
+        Re-executes the tool calls of a plan against the current frame.
+        Returns a list of (tool, tool_input, output), or None if any call fails.
+        """
+        tools = {tool.name: tool for tool in self.agent.tools}
+        metadata = snippet_metadata()
+        results = []
+        for name, tool_input in plan["steps"]:
+            if name not in tools:
+                return None
+            try:
+                output = str(tools[name].run(tool_input, metadata=metadata))
+            except Exception:
+                return None
+            if TOOL_ERROR_RE.match(output):
+                return None
+            results.append((name, tool_input, output))
+        return results
+
+    @staticmethod
+    def phrase_inputs(user_prompt, results):
+        steps = []
+        for name, tool_input, output in results:
+            if isinstance(tool_input, dict):
+                tool_input = tool_input.get("query", tool_input)
+            steps.append(f"{name}: {tool_input}\noutput:\n{output[:2000]}")
+        return {"results": "\n\n".join(steps), "query": user_prompt}
+
+    @staticmethod
+    def numbers_response(results):
+        outputs = [output.strip() for _, _, output in results if output.strip()]
+        return {
+            "status": 0,
+            "response": "\n\n".join(f"```\n{output}\n```" for output in outputs),
+        }
+
+    def replay_plan(self, user_prompt, use_cache=True, plan_mode=None):
+        """
+        Answers the question from its recorded plan without the agent loop.
+        Returns None when there is no plan or it no longer runs on the current frame.
+        """
+        plan = self.get_plan(user_prompt, use_cache, plan_mode)
+        results = self.run_plan(plan) if plan is not None else None
+        if results is None:
+            return None
+        if (plan_mode or self.plan_mode) == "numbers":
+            return self.numbers_response(results)
+        response_obj = self.phrase_chain().invoke(
+            self.phrase_inputs(user_prompt, results), config=trace_config("analysis")
+        )
+        assert isinstance(response_obj, dict)
+        return response_obj
+
+    async def areplay_plan(
+        self, user_prompt, timeout=None, use_cache=True, plan_mode=None
+    ):
+        plan = self.get_plan(user_prompt, use_cache, plan_mode)
+        if plan is None:
+            return None
+        results = await asyncio.to_thread(self.run_plan, plan)
+        if results is None:
+            return None
+        if (plan_mode or self.plan_mode) == "numbers":
+            return self.numbers_response(results)
+        inputs = self.phrase_inputs(user_prompt, results)
+        response_obj = await query_limiter.run(
+            lambda: self.phrase_chain().ainvoke(
+                inputs, config=trace_config("analysis")
+            ),
+            timeout,
+        )
+        assert isinstance(response_obj, dict)
+        return response_obj
+
+    def plan_events(self, user_prompt, results, plan_mode=None):
+        """
+        Stream events for a replayed plan, ending with the final event.
+        """
+        for name, tool_input, output in results:
+            yield {
+                "type": "tool",
+                "tool": name,
+                "input": str(tool_input),
+                "output": output,
+            }
+        if (plan_mode or self.plan_mode) == "numbers":
+            yield {"type": "final", "result": self.numbers_response(results)}
+            return
+        partials = self.phrase_chain().stream(
+            self.phrase_inputs(user_prompt, results), config=trace_config("analysis")
+        )
+        yield from response_deltas(partials)
+
+    async def aplan_events(self, user_prompt, results, plan_mode=None):
+        for name, tool_input, output in results:
+            yield {
+                "type": "tool",
+                "tool": name,
+                "input": str(tool_input),
+                "output": output,
+            }
+        if (plan_mode or self.plan_mode) == "numbers":
+            yield {"type": "final", "result": self.numbers_response(results)}
+            return
+        partials = self.phrase_chain().astream(
+            self.phrase_inputs(user_prompt, results), config=trace_config("analysis")
+        )
+        async for event in aresponse_deltas(partials):
+            yield event
+
+    @staticmethod
+    def query_config(callbacks=(), metadata=None):
+        """
+        Run config for one agent run. The pooled agent is shared by every session and query on
+        the frame, so each run gets its own namespace for the variables of its pandas code.
+        """
+        config = trace_config("analysis", callbacks)
+        config["metadata"] = metadata or snippet_metadata()
+        return config
+
+    def cache_key(self, user_prompt, plan_mode=None):
+        # self.key is (model, frame fingerprint or version token), raw numbers answers are
+        # cached apart from the phrased ones
+        numbers = (plan_mode or self.plan_mode) == "numbers"
+        return self.cache.make_key(
+            "analysis",
+            user_prompt,
+            self.model,
+            PROMPT_VERSION,
+            fingerprint=self.key[1],
+            extra="numbers" if numbers else None,
+        )
+
+    def query(self, user_prompt, use_cache=True, plan_mode=None):
+        """
+        Runs the query against the agent and returns response (or appropriate error)
+        plan_mode overrides the agent's plan mode for this query only.
+        """
+        try:
+            key = self.cache_key(user_prompt, plan_mode)
+            response_obj = self.cache.get(key, bypass=not use_cache)
+            if response_obj is not None:
+                return response_obj
+
+            response_obj = self.replay_plan(user_prompt, use_cache, plan_mode)
+            if response_obj is None:
+                prompt = self.format_prompt(user_prompt)
+                config = self.query_config()
+                response = self.agent.invoke(prompt, config=config)
+                raw_obj = response["output"]
+                response_obj = self.parser.invoke(raw_obj, config=config)
+                assert isinstance(response_obj, dict)
+                self.record_plan(
+                    user_prompt, response, response_obj, use_cache, plan_mode
+                )
+            self.cache.put(key, response_obj, bypass=not use_cache)
+            return response_obj
+
+        except Exception as e:
+            logging.error(f"{datetime.now()} Dataframe Agent Error: {str(e)}")
+            return {
+                "status": 2,
+                "response": "An unknown error occurred. Please try again later.",
+            }
+
+    async def aquery(self, user_prompt, timeout=None, use_cache=True, plan_mode=None):
+        """
+        Async counterpart of query, bounded by the process-wide query limiter.
+        """
         try:
-            prompt = prompt_template.format(query=user_prompt)
-            response = self.agent.invoke(prompt)
-            raw_obj = response["output"]
-            response_obj = self.parser.parse(raw_obj)
-            assert isinstance(response_obj, dict)
+            key = self.cache_key(user_prompt, plan_mode)
+            response_obj = self.cache.get(key, bypass=not use_cache)
+            if response_obj is not None:
+                return response_obj
+
+            response_obj = await self.areplay_plan(
+                user_prompt, timeout, use_cache, plan_mode
+            )
+            if response_obj is None:
+                prompt = self.format_prompt(user_prompt)
+                config = self.query_config()
+                response = await query_limiter.run(
+                    lambda: self.agent.ainvoke(prompt, config=config), timeout
+                )
+                raw_obj = response["output"]
+                response_obj = self.parser.invoke(raw_obj, config=config)
+                assert isinstance(response_obj, dict)
+                self.record_plan(
+                    user_prompt, response, response_obj, use_cache, plan_mode
+                )
+            self.cache.put(key, response_obj, bypass=not use_cache)
             return response_obj
 
+        except asyncio.TimeoutError:
+            logging.error(f"{datetime.now()} Dataframe Agent Timeout: {user_prompt}")
+            return {
+                "status": 2,
+                "response": "The request timed out. Please try again later.",
+            }
         except Exception as e:
             logging.error(f"{datetime.now()} Dataframe Agent Error: {str(e)}")
             return {
                 "status": 2,
                 "response": "An unknown error occurred. Please try again later.",
             }
+
+    def stream(self, user_prompt, use_cache=True, plan_mode=None):
+        """
+        Streaming counterpart of query. Yields tool results and response deltas while the
+        agent runs, then {"type": "final", "result": <query dict>}.
+        """
+        try:
+            key = self.cache_key(user_prompt, plan_mode)
+            response_obj = self.cache.get(key, bypass=not use_cache)
+            if response_obj is not None:
+                yield {"type": "final", "result": response_obj}
+                return
+
+            plan = self.get_plan(user_prompt, use_cache, plan_mode)
+            results = self.run_plan(plan) if plan is not None else None
+            if results is not None:
+                for event in self.plan_events(user_prompt, results, plan_mode):
+                    if event["type"] != "final":
+                        yield event
+                        continue
+                    response_obj = event["result"]
+                    assert isinstance(response_obj, dict)
+                    self.cache.put(key, response_obj, bypass=not use_cache)
+                yield {"type": "final", "result": response_obj}
+                return
+
+            prompt = self.format_prompt(user_prompt)
+            agent = self.agent
+            metadata = snippet_metadata()
+
+            def run(handler):
+                return agent.invoke(
+                    prompt, config=self.query_config([handler], metadata)
+                )
+
+            for event in stream_run(run):
+                if event["type"] != "final":
+                    yield event
+                    continue
+                response_obj = self.parser.invoke(
+                    event["result"]["output"], config=trace_config("analysis")
+                )
+                assert isinstance(response_obj, dict)
+                self.record_plan(
+                    user_prompt, event["result"], response_obj, use_cache, plan_mode
+                )
+                self.cache.put(key, response_obj, bypass=not use_cache)
+
+        except Exception as e:
+            logging.error(f"{datetime.now()} Dataframe Agent Error: {str(e)}")
+            response_obj = {
+                "status": 2,
+                "response": "An unknown error occurred. Please try again later.",
+            }
+        yield {"type": "final", "result": response_obj}
+
+    async def astream(self, user_prompt, timeout=None, use_cache=True, plan_mode=None):
+        """
+        Async iterator counterpart of stream. The streamed run holds a slot of the process-wide
+        query limiter and is bounded by timeout (seconds) as a whole.
+        """
+        try:
+            key = self.cache_key(user_prompt, plan_mode)
+            response_obj = self.cache.get(key, bypass=not use_cache)
+            if response_obj is not None:
+                yield {"type": "final", "result": response_obj}
+                return
+
+            plan = self.get_plan(user_prompt, use_cache, plan_mode)
+            results = None
+            if plan is not None:
+                results = await asyncio.to_thread(self.run_plan, plan)
+            if results is not None:
+                async for event in query_limiter.stream(
+                    lambda: self.aplan_events(user_prompt, results, plan_mode), timeout
+                ):
+                    if event["type"] != "final":
+                        yield event
+                        continue
+                    response_obj = event["result"]
+                    assert isinstance(response_obj, dict)
+                    self.cache.put(key, response_obj, bypass=not use_cache)
+                yield {"type": "final", "result": response_obj}
+                return
+
+            prompt = self.format_prompt(user_prompt)
+            agent = self.agent
+            metadata = snippet_metadata()
+
+            async def arun(handler):
+                return await agent.ainvoke(
+                    prompt, config=self.query_config([handler], metadata)
+                )
+
+            async for event in query_limiter.stream(lambda: astream_run(arun), timeout):
+                if event["type"] != "final":
+                    yield event
+                    continue
+                response_obj = self.parser.invoke(
+                    event["result"]["output"], config=trace_config("analysis")
+                )
+                assert isinstance(response_obj, dict)
+                self.record_plan(
+                    user_prompt, event["result"], response_obj, use_cache, plan_mode
+                )
+                self.cache.put(key, response_obj, bypass=not use_cache)
+
+        except asyncio.TimeoutError:
+            logging.error(f"{datetime.now()} Dataframe Agent Timeout: {user_prompt}")
+            response_obj = {
+                "status": 2,
+                "response": "The request timed out. Please try again later.",
+            }
+        except Exception as e:
+            logging.error(f"{datetime.now()} Dataframe Agent Error: {str(e)}")
+            response_obj = {
+                "status": 2,
+                "response": "An unknown error occurred. Please try again later.",
+            }
+        yield {"type": "final", "result": response_obj}
@@ -1,5 +1,6 @@
 import pandas as pd
-from intent_agent import IntentAgent
+from data_loader import load_frame
+from session import session_manager
 from IPython.display import display, Markdown
 
 
@@ -11,17 +12,16 @@ def read_data(is_parquet, filename="./data/all_data.csv"):
 
 
 def driver():
-    original_df = read_data(
-        False, "./data/all_data.csv"
-    )  # initial df needs to be read client side
-    original_df = original_df[original_df["data_type"] == "forModel"]
-    agent = IntentAgent()
-    params = {"df": original_df}  # params - df and features
+    # initial df needs to be read client side, the csv is converted to a typed parquet dataset once
+    # and only the forModel partition is read
+    original_df = load_frame("./data/all_data.csv", data_type="forModel")
+    # one session per user, frames with the same content are shared between sessions
+    session = session_manager.create(df=original_df)  # optionally features=[...]
     while (
         True
     ):  # could be a running loop for queries with loading spinner - error handling done in agent itself
         prompt = input("Q: ")
-        response = agent.query(prompt, params)
+        response = session.query(prompt)
 
         """
         Response object has the following structure:
@@ -33,7 +33,7 @@ def driver():
             change: float value indicating percent change that user wants to make (+ve for increase, -ve for decrease)
         }
 
-        In case of intent==forecast, use the feature and change value to make new prediction and then update the df passed in params to query
+        In case of intent==forecast, use the feature and change value to make new prediction and then load the new df into the session
         so that the user has the new df for analysis
         """
 
@@ -41,13 +41,18 @@ def driver():
         #     feature = response["feature"]
         #     change = response["change"]
         #     df = model.make_prediction({feature: change})
-        #     params["df"] = df  # update parameters for analysis
+        #     # only the forecasted columns (e.g. quantity and Dollars) are stored on top of the session's frame,
+        #     # pass columns=[...] to skip comparing the other columns. never modify session.df in place,
+        #     # it may be shared with other sessions
+        #     session.apply_forecast(df)
         #     # or break after new query
 
-        # if response["intent"] == "simulation"
-        # run the model 5 times changing response["feature"] (by default only "discount_percentage") from 0 to 5
+        # if response["intent"] == "simulation":
+        #     engine = SimulationEngine(model.make_prediction)  # or batch_forecast_fn=... for one vectorized call
+        #     results = engine.run(session.df, response["feature"], response["values"])
+        #     # results has one row per value of response["feature"] (by default "discount_percentage" from 0 to 5)
 
-        # for both forecast and simulation, pass the results to the LLM to analyze using the function agent.analyze_results
+        # for both forecast and simulation, pass the results to the LLM to analyze using the function session.agent.analyze_results
         # you will need to pass it both the original user_input and the resultant dataframe.
 
         print(f"> {response}\n")
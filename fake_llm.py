@@ -0,0 +1,141 @@
+import asyncio, json, re, time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+FEATURE_WORDS = {
+    "discount": "discount_percentage",
+    "price": "discount_percentage",
+    "gas": "gas_price",
+    "consumer price index": "consumer_price_index",
+    "cpi": "consumer_price_index",
+    "inflation": "inflation",
+    "temperature": "average_temperature",
+    "snow": "average_snow",
+}
+
+
+def extract_user_input(prompt):
+    """
+    The agent prompts place the user input directly after the JSON format instructions.
+    """
+    tail = prompt.rsplit("```", 1)[-1].strip()
+    return tail.splitlines()[0].strip() if tail else ""
+
+
+def classify_intent(text):
+    text = text.lower()
+    if re.search(r"\b(mergesort|write me|code|poem)\b", text):
+        return "error"
+    if re.search(r"\b(optimum|optimal|best)\b", text):
+        return "simulation"
+    if re.search(r"\b(increase|decrease|raise|lower|what happens)\b", text):
+        return "forecast"
+    if re.search(
+        r"\b(top|highest|lowest|which|average|correlat\w*|margin|sales|dataframe|roi|turnover)\b",
+        text,
+    ):
+        return "analysis"
+    return "conversation"
+
+
+def chunk_text(text, size=8):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic, offline stand-in for ChatOpenAI that answers the intent, forecast and
+    analysis prompts with well-formed JSON. Useful for load tests and benchmarks.
+    """
+
+    model_name: str = "fake"
+    latency: float = 0.0
+    responses: Dict[str, str] = {}  # prompt substring -> fixed reply
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def reply(self, prompt):
+        for marker, content in self.responses.items():
+            if marker in prompt:
+                return content
+
+        user_input = extract_user_input(prompt)
+        if "NavAI" in prompt:
+            intent = classify_intent(user_input)
+            return json.dumps(
+                {"intent": intent, "response": f"Fake {intent} reply to: {user_input}"}
+            )
+        if "features that the user can modify" in prompt:
+            lowered = user_input.lower()
+            feature = next(
+                (name for word, name in FEATURE_WORDS.items() if word in lowered), None
+            )
+            number = re.search(r"-?\d+(\.\d+)?", lowered)
+            if feature is None or number is None:
+                return json.dumps(
+                    {
+                        "status": 1,
+                        "feature": "",
+                        "change": 0.0,
+                        "response": "Please indicate both the feature and the percent change.",
+                    }
+                )
+            change = float(number.group())
+            if re.search(r"\b(decrease|lower|reduce)\b", lowered):
+                change = -change
+            if "price" in lowered:
+                change = -change
+            return json.dumps(
+                {
+                    "status": 0,
+                    "feature": feature,
+                    "change": change,
+                    "response": "Your forecast will be generated shortly.",
+                }
+            )
+        return json.dumps(
+            {"status": 0, "response": f"**Fake analysis** for: {user_input[:200]}"}
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        content = self.reply("\n".join(str(message.content) for message in messages))
+        if run_manager is not None:
+            for chunk in chunk_text(content):
+                run_manager.on_llm_new_token(chunk)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=content))]
+        )
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = self.reply("\n".join(str(message.content) for message in messages))
+        if run_manager is not None:
+            for chunk in chunk_text(content):
+                await run_manager.on_llm_new_token(chunk)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=content))]
+        )
@@ -0,0 +1,200 @@
+import re, threading
+from collections import Counter
+
+from tracing import get_tracer
+
+# phrasing -> forecast feature, longest phrases first so "gas price" wins over "price"
+FEATURE_SYNONYMS = {
+    "consumer price index": "consumer_price_index",
+    "average temperature": "average_temperature",
+    "discount percentage": "discount_percentage",
+    "inflation rate": "inflation",
+    "average snow": "average_snow",
+    "gas prices": "gas_price",
+    "gas price": "gas_price",
+    "fuel price": "gas_price",
+    "temperature": "average_temperature",
+    "discounts": "discount_percentage",
+    "inflation": "inflation",
+    "snowfall": "average_snow",
+    "discount": "discount_percentage",
+    "prices": "price",
+    "price": "price",
+    "temp": "average_temperature",
+    "snow": "average_snow",
+    "fuel": "gas_price",
+    "gas": "gas_price",
+    "cpi": "consumer_price_index",
+}
+
+FEATURE_PHRASES = "|".join(re.escape(phrase) for phrase in FEATURE_SYNONYMS)
+FEATURE_RE = re.compile(rf"\b({FEATURE_PHRASES})\b", re.IGNORECASE)
+INCREASE_WORDS = r"increase[sd]?|increasing|raise[sd]?|raising|boost(?:s|ed)?|rise[sn]?|rose|go(?:es)? up|up"
+DECREASE_WORDS = r"decrease[sd]?|decreasing|reduce[sd]?|reducing|lower(?:s|ed)?|cut(?:s)?|drop(?:s|ped)?|fall(?:s)?|fell|go(?:es)? down|down"
+CHANGE_WORDS = f"{INCREASE_WORDS}|{DECREASE_WORDS}"
+INCREASE_RE = re.compile(rf"\b({INCREASE_WORDS})\b", re.IGNORECASE)
+NUMBER_RE = re.compile(r"[-+]?\d+(?:\.\d+)?")
+# the change as one phrase, "<verb> [the] <feature> by N" or "<feature> <verb> by N", so the
+# direction and amount are known to apply to the feature
+CHANGE_RE = re.compile(
+    rf"\b(?:(?P<verb>{CHANGE_WORDS})\s+(?:the\s+)?(?P<feature>{FEATURE_PHRASES})"
+    rf"|(?P<subject>{FEATURE_PHRASES})\s+(?P<subject_verb>{CHANGE_WORDS}))"
+    r"\s+by\s+(?P<number>\d+(?:\.\d+)?)\s*(%|percent|per cent|pct)?(?=[\s?.!,]|$)",
+    re.IGNORECASE,
+)
+# changes of the outcome ("sales fell by 10%") and questions about the past ("why did ...")
+# are analysis questions even when they name a feature
+OUTCOME_RE = re.compile(
+    rf"\b(sales|revenue|units|unit sales|dollars|quantity|volume)\s+({CHANGE_WORDS})\b",
+    re.IGNORECASE,
+)
+PAST_QUESTION_RE = re.compile(
+    r"^\s*(why|did|how much|how many|was|were|has|have|had)\b|\bwhy\b", re.IGNORECASE
+)
+# phrasing that suggests analysis or simulation rather than a single forecast change
+AMBIGUOUS_RE = re.compile(
+    r"\b(which|who|list|show|top|rank\w*|correlat\w*|trend\w*|histor\w*|last|past|compare|optim\w*|best|maximi\w*|minimi\w*|simulat\w*|schedule|and then|both)\b",
+    re.IGNORECASE,
+)
+
+# keyword cues per intent for the speculative dispatch prior
+INTENT_CUES = {
+    "forecast": re.compile(
+        r"\b(increase\w*|decrease\w*|raise\w*|lower\w*|reduc\w*|what happens|what if|change)\b",
+        re.IGNORECASE,
+    ),
+    "analysis": re.compile(
+        r"\b(top|highest|lowest|most|least|which|average|mean|total|correlat\w*|margin\w*|roi|turnover|trend\w*|compare|how many|volume|dataframe)\b",
+        re.IGNORECASE,
+    ),
+    "simulation": re.compile(
+        r"\b(optim\w*|best|maximi\w*|minimi\w*|ideal|simulat\w*)\b", re.IGNORECASE
+    ),
+    "conversation": re.compile(
+        r"\b(hi|hello|hey|thanks|thank you|what can you do|who are you|help|incorrect|wrong)\b",
+        re.IGNORECASE,
+    ),
+}
+
+
+class IntentPrior:
+    def __init__(self, recent_weight=0.3, smoothing=0.1):
+        """
+        Cheap local guess of the intent of a question, mixing keyword cues with the intents
+        recently seen in the session (recent_weight is the share given to the latter).
+        """
+        self.recent_weight = recent_weight
+        self.smoothing = smoothing
+
+    def probabilities(self, user_input, recent=()):
+        scores = {
+            intent: len(cue.findall(user_input)) for intent, cue in INTENT_CUES.items()
+        }
+        total = sum(scores.values()) + self.smoothing * len(scores)
+        probabilities = {
+            intent: (score + self.smoothing) / total for intent, score in scores.items()
+        }
+        if recent:
+            counts = Counter(recent)
+            probabilities = {
+                intent: (1 - self.recent_weight) * p
+                + self.recent_weight * counts[intent] / len(recent)
+                for intent, p in probabilities.items()
+            }
+        return probabilities
+
+    def predict(self, user_input, recent=()):
+        """
+        Returns the most likely intent and its probability.
+        """
+        probabilities = self.probabilities(user_input, recent)
+        intent = max(probabilities, key=probabilities.get)
+        return intent, probabilities[intent]
+
+
+class FastPathParser:
+    def __init__(self):
+        """
+        Local rule-based parser for formulaic forecast requests such as "Increase inflation by 5%".
+        Anything it is not confident about is left to the LLM chains.
+        """
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def parse(self, user_input, features):
+        """
+        Returns the same dict as InterfaceAgent.query (with intent="forecast") or None when unsure.
+        """
+        result = self._parse(user_input, features)
+        with self.lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        # process-wide counts, the parser's own only cover one session
+        get_tracer().metrics.increment(
+            "fast_path_total", outcome="miss" if result is None else "hit"
+        )
+        return result
+
+    def _parse(self, user_input, features):
+        if AMBIGUOUS_RE.search(user_input):
+            return None
+
+        if OUTCOME_RE.search(user_input) or PAST_QUESTION_RE.search(user_input):
+            return None
+
+        matched = {FEATURE_SYNONYMS[m.lower()] for m in FEATURE_RE.findall(user_input)}
+        if len(matched) != 1:
+            return None
+        if len(NUMBER_RE.findall(user_input)) != 1:
+            return None
+
+        phrase = CHANGE_RE.search(user_input)
+        if phrase is None:
+            return None
+        feature = FEATURE_SYNONYMS[(phrase["feature"] or phrase["subject"]).lower()]
+        change = float(phrase["number"])
+        if change == 0:
+            return None
+        if not INCREASE_RE.fullmatch(phrase["verb"] or phrase["subject_verb"]):
+            change = -change
+
+        # price can only be changed through discount_percentage, in the inverse direction
+        if feature == "price":
+            feature = "discount_percentage"
+            change = -change
+        if feature not in features:
+            return None
+
+        direction = "increase" if change > 0 else "decrease"
+        return {
+            "status": 0,
+            "intent": "forecast",
+            "feature": feature,
+            "change": change,
+            "response": f"Your forecast with a {abs(change):g}% {direction} in {feature} will be generated shortly.",
+        }
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate()}
+
+
+def stats():
+    """
+    Inputs answered locally and left to the LLM by every parser in the process.
+    """
+    metrics = get_tracer().metrics
+    hits = metrics.value("fast_path_total", outcome="hit")
+    misses = metrics.value("fast_path_total", outcome="miss")
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0.0,
+    }
@@ -1,23 +1,40 @@
-import os, logging
-import secret
+import asyncio, logging, os, threading
+from collections import deque
 from datetime import datetime
+from concurrency import query_limiter
+from fast_path import FastPathParser, IntentPrior
+from llm import get_chat_model, get_compiled, model_name
+from response_cache import get_default_cache
+from simulation import DEFAULT_SWEEP
+from tracing import get_tracer, trace_config
 
 # agents
-from interface_agent import InterfaceAgent
+from interface_agent import DEFAULT_FEATURES, InterfaceAgent
 from dataframe_agent import DataframeAnalysisAgent
 
 # langchain imports
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
+from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.pydantic_v1 import BaseModel, Field
 
-os.environ["OPENAI_API_KEY"] = secret.OPENAI_KEY
-
 logging.basicConfig(
     filename="agent_errors.txt", encoding="utf-8", level=logging.WARNING
 )
 
+# bump whenever the prompt changes so cached responses are invalidated
+PROMPT_VERSION = 1
+
+# minimum prior probability to start the likely sub-agent before the intent is known,
+# lower trades more wasted LLM calls for lower latency, unset disables speculation
+SPECULATION_THRESHOLD = (
+    float(os.environ["NAVSOFT_SPECULATION_THRESHOLD"])
+    if "NAVSOFT_SPECULATION_THRESHOLD" in os.environ
+    else None
+)
+
+# intents whose sub-agent can be started speculatively
+SPECULATIVE_INTENTS = ("forecast", "analysis")
+
 
 class Intent(BaseModel):
     intent: str = Field(
@@ -27,18 +44,42 @@ class Intent(BaseModel):
 
 
 class IntentAgent:
-    def __init__(self, gpt4=True):
+    def __init__(self, gpt4=True, fast_path=True, speculation_threshold=None):
         """
         Creates llm agent to recognize user intent and forward to respective agent.
+        With fast_path, formulaic forecast requests are parsed locally without calling the LLM.
+        With speculation_threshold (default NAVSOFT_SPECULATION_THRESHOLD), aquery starts the
+        likely sub-agent alongside the intent chain when its prior probability reaches it.
+        An IntentAgent holds the sub-agents of one session, see session.SessionManager.
         """
         self.gpt4 = gpt4
-        model_name = "gpt-4-0125-preview" if gpt4 else "gpt-3.5-turbo-1106"
-        self.model = ChatOpenAI(model=model_name, temperature=0.1)
+        self.fast_path = FastPathParser() if fast_path else None
+        self.model_name = model_name(gpt4)
+        self.model = get_chat_model(self.model_name, temperature=0.1)
+        self.cache = get_default_cache()
         self.parser = JsonOutputParser(pydantic_object=Intent)
         self.chain = None
+        self.interface_agent = None
+        self.analysis_agent = None
+        self.speculation_threshold = (
+            SPECULATION_THRESHOLD
+            if speculation_threshold is None
+            else speculation_threshold
+        )
+        self.prior = IntentPrior()
+        self.recent_intents = deque(maxlen=20)
+        self.speculation_counts = {"started": 0, "hits": 0, "wasted": 0}
+        # the async paths load frames in worker threads, one at a time per session
+        self.agents_lock = threading.Lock()
         self.create_chain()
 
     def create_chain(self):
+        """
+        Chains are compiled once per process and model, and shared by every agent instance.
+        """
+        self.chain = get_compiled(("intent_chain", self.model_name), self.build_chain)
+
+    def build_chain(self):
         prompt = PromptTemplate(
             template="""You are NavAI, a helpful data science chatbot created by NavSoft. Your role is to help users run analytical queries, generate forecasts and simulations to find optimal parameters for their businesses.
             
@@ -80,13 +121,31 @@ class IntentAgent:
                 "format_instructions": self.parser.get_format_instructions()
             },
         )
-        self.chain = prompt | self.model | self.parser
+        return prompt | self.model | self.parser
+
+    def get_interface_agent(self, features):
+        with self.agents_lock:
+            if (
+                self.interface_agent is None
+                or self.interface_agent.features != features
+            ):
+                self.interface_agent = InterfaceAgent(self.gpt4, features)
+            return self.interface_agent
+
+    def get_analysis_agent(self, df, version=None):
+        with self.agents_lock:
+            if self.analysis_agent is None:
+                self.analysis_agent = DataframeAnalysisAgent(gpt4=self.gpt4)
+            if df is not None:
+                self.analysis_agent.load_new_df(df, version)
+            return self.analysis_agent
 
     def analyze_results(self, user_input, df):
         """
         Analyze the dataframe results and call
         """
         try:
+            # a separate agent so the session's analysis frame is left as is
             agent = DataframeAnalysisAgent(df, self.gpt4)
             prompt = f"""
             Please analyse the results of the given dataframe. The dataframe results were generated by the following question: {user_input}.
@@ -102,46 +161,282 @@ class IntentAgent:
                 "response": "An unknown error occured. Please try again later.",
             }
 
+    def route(self, response_obj, params):
+        """
+        Picks the sub-agent for the recognized intent.
+        Returns (agent, None), or (None, response) when the intent needs no sub-agent.
+        Loading the frame may build an agent, so the async paths call this in a thread.
+        """
+        intent = response_obj["intent"]
+        if intent == "conversation":
+            return None, {"status": 0, "response": response_obj["response"]}
+        elif intent == "forecast":
+            # for a set of features apart from the default hardcoded list
+            features = params.get("features", None) or DEFAULT_FEATURES
+            return self.get_interface_agent(features), None
+        elif intent == "analysis":
+            df = params.get("df", None)
+            agent = self.get_analysis_agent(df, params.get("df_version", None))
+            return agent, None
+        elif intent == "simulation":
+            return None, {
+                "status": 0,
+                "intent": "simulation",
+                "feature": "discount_percentage",  # default simulation feature for now
+                "values": DEFAULT_SWEEP,
+            }
+        return None, {
+            "status": 2,
+            "response": "I'm sorry, I can only answer questions related to dataframe analytics and forecasting.",
+        }
+
+    @staticmethod
+    def agent_options(agent, params):
+        """
+        Per query options for the sub-agent. The plan mode is passed with each call since
+        the analysis agent is shared by concurrent queries, e.g. in batch.py.
+        """
+        if isinstance(agent, DataframeAnalysisAgent):
+            return {"plan_mode": params.get("plan_mode", None)}
+        return {}
+
+    def fast_response(self, user_input, params):
+        """
+        Returns the locally parsed response for formulaic inputs, or None to fall through to the LLM.
+        """
+        if self.fast_path is None:
+            return None
+        features = params.get("features", None) or DEFAULT_FEATURES
+        return self.fast_path.parse(user_input, features)
+
+    def classify(self, user_input, use_cache=True):
+        """
+        Runs (or looks up) the intent chain for the user input.
+        """
+        key = self.cache.make_key("intent", user_input, self.model_name, PROMPT_VERSION)
+        response_obj = self.cache.get(key, bypass=not use_cache)
+        if response_obj is None:
+            response_obj = self.chain.invoke(
+                {"user_input": user_input}, config=trace_config("intent")
+            )
+            assert isinstance(response_obj, dict)
+            self.cache.put(key, response_obj, bypass=not use_cache)
+        self.recent_intents.append(response_obj["intent"])
+        return response_obj
+
+    async def aclassify(self, user_input, use_cache=True, timeout=None):
+        key = self.cache.make_key("intent", user_input, self.model_name, PROMPT_VERSION)
+        response_obj = self.cache.get(key, bypass=not use_cache)
+        if response_obj is None:
+            response_obj = await query_limiter.run(
+                lambda: self.chain.ainvoke(
+                    {"user_input": user_input}, config=trace_config("intent")
+                ),
+                timeout,
+            )
+            assert isinstance(response_obj, dict)
+            self.cache.put(key, response_obj, bypass=not use_cache)
+        self.recent_intents.append(response_obj["intent"])
+        return response_obj
+
+    def speculate(self, user_input, params, timeout=None, use_cache=True):
+        """
+        Starts the sub-agent of the most likely intent as a task, or returns (None, None) when
+        speculation is off or the prior is not confident enough.
+        """
+        if self.speculation_threshold is None:
+            return None, None
+        intent, probability = self.prior.predict(user_input, self.recent_intents)
+        if (
+            intent not in SPECULATIVE_INTENTS
+            or probability < self.speculation_threshold
+        ):
+            return None, None
+
+        async def run():
+            agent, _ = await asyncio.to_thread(self.route, {"intent": intent}, params)
+            return await agent.aquery(
+                user_input,
+                timeout,
+                use_cache=use_cache,
+                **self.agent_options(agent, params),
+            )
+
+        self.count_speculation("started")
+        return intent, asyncio.ensure_future(run())
+
+    def count_speculation(self, outcome):
+        self.speculation_counts[outcome] += 1
+        get_tracer().metrics.increment("speculation_total", outcome=outcome)
+
+    def speculation_stats(self):
+        counts = dict(self.speculation_counts)
+        counts["hit_rate"] = (
+            counts["hits"] / counts["started"] if counts["started"] else 0.0
+        )
+        return counts
+
     def query(self, user_input, params={}):
         """
         Recognizes user intent and calls on the appropriate agent to handle the query.
+        Set params["use_cache"] = False to bypass the response and plan caches, and
+        params["plan_mode"] to "phrase", "numbers" or "off" to choose how analysis plans are replayed.
         """
         try:
-            response_obj = self.chain.invoke({"user_input": user_input})
-            assert isinstance(response_obj, dict)
-            intent = response_obj["intent"]
-            agent = None
-            if intent == "conversation":
-                return {"status": 0, "response": response_obj["response"]}
-            elif intent == "forecast":
-                features = params.get("features", None)
-                if features is None:
-                    agent = InterfaceAgent(self.gpt4)
-                else:  # for a set of features apart from the default hardcoded list
-                    agent = InterfaceAgent(self.gpt4, features)
-
-            elif intent == "analysis":
-                df = params.get("df", None)
-                agent = DataframeAnalysisAgent(df, self.gpt4)
-            elif intent == "simulation":
-                return {
-                    "status": 0,
-                    "intent": "simulation",
-                    "feature": "discount_percentage",  # default simulation feature for now
-                }
-            else:
-                return {
-                    "status": 2,
-                    "response": "I'm sorry, I can only answer questions related to dataframe analytics and forecasting.",
-                }
+            fast_response = self.fast_response(user_input, params)
+            if fast_response is not None:
+                return fast_response
+
+            use_cache = params.get("use_cache", True)
+            response_obj = self.classify(user_input, use_cache)
+            agent, response = self.route(response_obj, params)
+            if agent is None:
+                return response
+
+            agent_response_obj = agent.query(
+                user_input, use_cache=use_cache, **self.agent_options(agent, params)
+            )
+            agent_response_obj["intent"] = response_obj["intent"]
+            return agent_response_obj
 
-            agent_response_obj = agent.query(user_input)
-            agent_response_obj["intent"] = intent
+        except Exception as e:
+            logging.error(f"{datetime.now()} Intent Agent Error: {str(e)}")
+            return {
+                "status": 2,
+                "response": "An unknown error occured. Please try again later.",
+            }
+
+    async def aquery(self, user_input, params={}, timeout=None):
+        """
+        Async counterpart of query. Each LLM call is bounded by the process-wide query limiter
+        and by timeout (seconds), cancelling the call if it runs over.
+        When speculating, the likely sub-agent runs alongside the intent chain and is cancelled
+        if the recognized intent turns out to be different.
+        """
+        speculative_task = None
+        try:
+            fast_response = self.fast_response(user_input, params)
+            if fast_response is not None:
+                return fast_response
+
+            use_cache = params.get("use_cache", True)
+            guess, speculative_task = self.speculate(
+                user_input, params, timeout, use_cache
+            )
+            response_obj = await self.aclassify(user_input, use_cache, timeout)
+            if speculative_task is not None:
+                if response_obj["intent"] == guess:
+                    self.count_speculation("hits")
+                    agent_response_obj = await speculative_task
+                    agent_response_obj["intent"] = response_obj["intent"]
+                    return agent_response_obj
+                speculative_task.cancel()
+                self.count_speculation("wasted")
+
+            agent, response = await asyncio.to_thread(self.route, response_obj, params)
+            if agent is None:
+                return response
+
+            agent_response_obj = await agent.aquery(
+                user_input,
+                timeout,
+                use_cache=use_cache,
+                **self.agent_options(agent, params),
+            )
+            agent_response_obj["intent"] = response_obj["intent"]
             return agent_response_obj
 
+        except asyncio.TimeoutError:
+            logging.error(f"{datetime.now()} Intent Agent Timeout: {user_input}")
+            return {
+                "status": 2,
+                "response": "The request timed out. Please try again later.",
+            }
         except Exception as e:
             logging.error(f"{datetime.now()} Intent Agent Error: {str(e)}")
             return {
                 "status": 2,
                 "response": "An unknown error occured. Please try again later.",
             }
+        finally:
+            if speculative_task is not None and not speculative_task.done():
+                speculative_task.cancel()
+
+    def stream(self, user_input, params={}):
+        """
+        Streaming counterpart of query. Yields tool results and response deltas from the
+        sub-agent as they are produced, ending with {"type": "final", "result": <query dict>}.
+        """
+        try:
+            fast_response = self.fast_response(user_input, params)
+            if fast_response is not None:
+                yield {"type": "final", "result": fast_response}
+                return
+
+            use_cache = params.get("use_cache", True)
+            response_obj = self.classify(user_input, use_cache)
+            agent, response = self.route(response_obj, params)
+            if agent is None:
+                yield {"type": "final", "result": response}
+                return
+
+            options = self.agent_options(agent, params)
+            for event in agent.stream(user_input, use_cache=use_cache, **options):
+                if event["type"] == "final":
+                    event["result"]["intent"] = response_obj["intent"]
+                yield event
+
+        except Exception as e:
+            logging.error(f"{datetime.now()} Intent Agent Error: {str(e)}")
+            yield {
+                "type": "final",
+                "result": {
+                    "status": 2,
+                    "response": "An unknown error occured. Please try again later.",
+                },
+            }
+
+    async def astream(self, user_input, params={}, timeout=None):
+        """
+        Async iterator counterpart of stream. timeout (seconds) bounds the intent chain and the
+        streamed sub-agent run separately.
+        """
+        try:
+            fast_response = self.fast_response(user_input, params)
+            if fast_response is not None:
+                yield {"type": "final", "result": fast_response}
+                return
+
+            use_cache = params.get("use_cache", True)
+            response_obj = await self.aclassify(user_input, use_cache, timeout)
+            agent, response = await asyncio.to_thread(self.route, response_obj, params)
+            if agent is None:
+                yield {"type": "final", "result": response}
+                return
+
+            options = self.agent_options(agent, params)
+            async for event in agent.astream(
+                user_input, timeout, use_cache=use_cache, **options
+            ):
+                if event["type"] == "final":
+                    event["result"]["intent"] = response_obj["intent"]
+                yield event
+
+        except asyncio.TimeoutError:
+            logging.error(f"{datetime.now()} Intent Agent Timeout: {user_input}")
+            yield {
+                "type": "final",
+                "result": {
+                    "status": 2,
+                    "response": "The request timed out. Please try again later.",
+                },
+            }
+        except Exception as e:
+            logging.error(f"{datetime.now()} Intent Agent Error: {str(e)}")
+            yield {
+                "type": "final",
+                "result": {
+                    "status": 2,
+                    "response": "An unknown error occured. Please try again later.",
+                },
+            }
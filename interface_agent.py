@@ -1,19 +1,32 @@
-import os, logging
-import secret
+import asyncio, logging
 from datetime import datetime
+from concurrency import query_limiter
+from llm import get_chat_model, get_compiled, model_name
+from response_cache import get_default_cache
+from streaming import aresponse_deltas, response_deltas
+from tracing import trace_config
 
 # langchain imports
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
+from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.pydantic_v1 import BaseModel, Field
 
-os.environ["OPENAI_API_KEY"] = secret.OPENAI_KEY
-
 logging.basicConfig(
     filename="agent_errors.txt", encoding="utf-8", level=logging.WARNING
 )
 
+# bump whenever the prompt changes so cached responses are invalidated
+PROMPT_VERSION = 1
+
+DEFAULT_FEATURES = [
+    "discount_percentage",
+    "gas_price",
+    "consumer_price_index",
+    "inflation",
+    "average_temperature",
+    "average_snow",
+]
+
 
 class Forecast(BaseModel):
     status: int = Field(
@@ -29,47 +42,31 @@ class Forecast(BaseModel):
 
 
 class InterfaceAgent:
-    def __new__(
-        cls,
-        gpt4=True,
-        features=[
-            "discount_percentage",
-            "gas_price",
-            "consumer_price_index",
-            "inflation",
-            "average_temperature",
-            "average_snow",
-        ],
-    ):
-        """
-        Interface Agent is a singleton class so that we don't need to reload the parser and model chain.
-        """
-        if not hasattr(cls, "instance"):
-            cls.instance = super(InterfaceAgent, cls).__new__(cls)
-            cls.instance.gpt4 = gpt4
-            cls.instance.features = features
-        return cls.instance
-
     def __init__(
         self,
         gpt4=True,
-        features=[
-            "discount_percentage",
-            "gas_price",
-            "consumer_price_index",
-            "inflation",
-            "average_temperature",
-            "average_snow",
-        ],
+        features=DEFAULT_FEATURES,
     ):
-        model_name = "gpt-4-0125-preview" if gpt4 else "gpt-3.5-turbo-1106"
-        self.model = ChatOpenAI(model=model_name, temperature=0.1)
+        """
+        Forecast parameter agent for one session. The model and chain are shared process-wide,
+        only the feature list is per instance.
+        """
+        self.gpt4 = gpt4
+        self.model_name = model_name(gpt4)
+        self.model = get_chat_model(self.model_name, temperature=0.1)
+        self.cache = get_default_cache()
         self.parser = JsonOutputParser(pydantic_object=Forecast)
         self.chain = None
         self.features = features
         self.create_chain()
 
     def create_chain(self):
+        """
+        Chains are compiled once per process and model, and shared by every agent instance.
+        """
+        self.chain = get_compiled(("forecast_chain", self.model_name), self.build_chain)
+
+    def build_chain(self):
         prompt = PromptTemplate(
             template="""
             You are a helpful data scientist that is helping understand some provided user request. The user is trying to instruct the system on what parameters of a forecast to modify. You are going to help the system understand what parameters can be modified.
@@ -108,23 +105,145 @@ class InterfaceAgent:
                 "format_instructions": self.parser.get_format_instructions()
             },
         )
-        self.chain = prompt | self.model | self.parser
+        return prompt | self.model | self.parser
 
-    def query(self, user_input):
+    def cache_key(self, user_input):
+        return self.cache.make_key(
+            "forecast", user_input, self.model_name, PROMPT_VERSION, extra=self.features
+        )
+
+    def query(self, user_input, use_cache=True):
         """
         Parses user input to extract relevant forecasting information
         """
 
         try:
+            key = self.cache_key(user_input)
+            response_obj = self.cache.get(key, bypass=not use_cache)
+            if response_obj is not None:
+                return response_obj
+
             response_obj = self.chain.invoke(
-                {"features": ", ".join(self.features), "user_input": user_input}
+                {"features": ", ".join(self.features), "user_input": user_input},
+                config=trace_config("forecast"),
+            )
+            assert isinstance(response_obj, dict)
+            self.cache.put(key, response_obj, bypass=not use_cache)
+            return response_obj
+
+        except Exception as e:
+            logging.error(f"{datetime.now()} Interface Agent Error: {str(e)}")
+            return {
+                "status": 2,
+                "response": "An unknown error occured. Please try again later.",
+            }
+
+    async def aquery(self, user_input, timeout=None, use_cache=True):
+        """
+        Async counterpart of query, bounded by the process-wide query limiter.
+        """
+
+        try:
+            key = self.cache_key(user_input)
+            response_obj = self.cache.get(key, bypass=not use_cache)
+            if response_obj is not None:
+                return response_obj
+
+            response_obj = await query_limiter.run(
+                lambda: self.chain.ainvoke(
+                    {"features": ", ".join(self.features), "user_input": user_input},
+                    config=trace_config("forecast"),
+                ),
+                timeout,
             )
             assert isinstance(response_obj, dict)
+            self.cache.put(key, response_obj, bypass=not use_cache)
             return response_obj
 
+        except asyncio.TimeoutError:
+            logging.error(f"{datetime.now()} Interface Agent Timeout: {user_input}")
+            return {
+                "status": 2,
+                "response": "The request timed out. Please try again later.",
+            }
         except Exception as e:
             logging.error(f"{datetime.now()} Interface Agent Error: {str(e)}")
             return {
                 "status": 2,
                 "response": "An unknown error occured. Please try again later.",
             }
+
+    def stream(self, user_input, use_cache=True):
+        """
+        Streaming counterpart of query, yielding response deltas and then the final dict.
+        """
+        try:
+            key = self.cache_key(user_input)
+            response_obj = self.cache.get(key, bypass=not use_cache)
+            if response_obj is not None:
+                yield {"type": "final", "result": response_obj}
+                return
+
+            partials = self.chain.stream(
+                {"features": ", ".join(self.features), "user_input": user_input},
+                config=trace_config("forecast"),
+            )
+            for event in response_deltas(partials):
+                if event["type"] == "final":
+                    assert isinstance(event["result"], dict)
+                    self.cache.put(key, event["result"], bypass=not use_cache)
+                yield event
+
+        except Exception as e:
+            logging.error(f"{datetime.now()} Interface Agent Error: {str(e)}")
+            yield {
+                "type": "final",
+                "result": {
+                    "status": 2,
+                    "response": "An unknown error occured. Please try again later.",
+                },
+            }
+
+    async def astream(self, user_input, timeout=None, use_cache=True):
+        """
+        Async iterator counterpart of stream, holding a query limiter slot for the whole stream
+        and bounded by timeout (seconds).
+        """
+        try:
+            key = self.cache_key(user_input)
+            response_obj = self.cache.get(key, bypass=not use_cache)
+            if response_obj is not None:
+                yield {"type": "final", "result": response_obj}
+                return
+
+            inputs = {"features": ", ".join(self.features), "user_input": user_input}
+            events = query_limiter.stream(
+                lambda: aresponse_deltas(
+                    self.chain.astream(inputs, config=trace_config("forecast"))
+                ),
+                timeout,
+            )
+            async for event in events:
+                if event["type"] == "final":
+                    assert isinstance(event["result"], dict)
+                    self.cache.put(key, event["result"], bypass=not use_cache)
+                yield event
+
+        except asyncio.TimeoutError:
+            logging.error(f"{datetime.now()} Interface Agent Timeout: {user_input}")
+            yield {
+                "type": "final",
+                "result": {
+                    "status": 2,
+                    "response": "The request timed out. Please try again later.",
+                },
+            }
+        except Exception as e:
+            logging.error(f"{datetime.now()} Interface Agent Error: {str(e)}")
+            yield {
+                "type": "final",
+                "result": {
+                    "status": 2,
+                    "response": "An unknown error occured. Please try again later.",
+                },
+            }
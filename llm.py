@@ -0,0 +1,107 @@
+import os, threading
+
+# optional override used to swap in a local stand-in, see set_chat_model_factory
+_chat_model_factory = None
+
+# process-wide registry of models, compiled prompts/chains and the pooled OpenAI clients
+_registry = {}
+_registry_lock = threading.RLock()
+
+
+def model_name(gpt4=True):
+    return "gpt-4-0125-preview" if gpt4 else "gpt-3.5-turbo-1106"
+
+
+def resolve_api_key():
+    """
+    Loads the OpenAI key from secret.py (or the environment) the first time a real model is built.
+    """
+    try:
+        import secret
+
+        os.environ["OPENAI_API_KEY"] = secret.OPENAI_KEY
+    except ImportError:
+        if "OPENAI_API_KEY" not in os.environ:
+            raise RuntimeError(
+                "No OpenAI key found, add it to secret.py or set OPENAI_API_KEY."
+            )
+
+
+def set_chat_model_factory(factory=None):
+    """
+    Installs factory(model_name, temperature) as the source of chat models for every agent.
+    Pass None to go back to ChatOpenAI. Clears the registry so chains pick up the new models.
+    """
+    global _chat_model_factory
+    with _registry_lock:
+        _chat_model_factory = factory
+        _registry.clear()
+
+
+def get_compiled(key, build):
+    """
+    Returns the object registered under key, calling build() the first time.
+    Used so that models, prompts and chains are built once per process.
+    """
+    with _registry_lock:
+        if key not in _registry:
+            _registry[key] = build()
+        return _registry[key]
+
+
+def openai_clients():
+    """
+    One keep-alive connection pool shared by every ChatOpenAI instance, as
+    (sync completions client, async completions client).
+    NAVSOFT_HTTP_MAX_CONNECTIONS bounds the pool size.
+    """
+
+    def build():
+        import httpx, openai
+
+        resolve_api_key()
+        max_connections = int(os.environ.get("NAVSOFT_HTTP_MAX_CONNECTIONS", 32))
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=60,
+        )
+        sync_client = openai.OpenAI(http_client=httpx.Client(limits=limits))
+        async_client = openai.AsyncOpenAI(http_client=httpx.AsyncClient(limits=limits))
+        return sync_client.chat.completions, async_client.chat.completions
+
+    return get_compiled(("openai_clients",), build)
+
+
+def _build_chat_model(model_name, temperature, streaming):
+    if _chat_model_factory is not None:
+        return _chat_model_factory(model_name, temperature)
+    if os.environ.get("NAVSOFT_FAKE_LLM"):
+        from fake_llm import FakeChatModel
+
+        return FakeChatModel(
+            model_name=model_name,
+            latency=float(os.environ.get("NAVSOFT_FAKE_LLM_LATENCY", 0.0)),
+        )
+
+    from langchain_openai import ChatOpenAI
+
+    client, async_client = openai_clients()
+    return ChatOpenAI(
+        model=model_name,
+        temperature=temperature,
+        streaming=streaming,
+        client=client,
+        async_client=async_client,
+    )
+
+
+def get_chat_model(model_name, temperature=0.1, streaming=False):
+    """
+    Returns the shared chat model used by the agents, streaming tokens to callbacks if requested.
+    Set NAVSOFT_FAKE_LLM=1 to use the deterministic offline stand-in instead of OpenAI.
+    """
+    return get_compiled(
+        ("model", model_name, temperature, streaming),
+        lambda: _build_chat_model(model_name, temperature, streaming),
+    )
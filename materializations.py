@@ -0,0 +1,204 @@
+import numpy as np
+import pandas as pd
+
+
+def _product_sales(df):
+    grouped = df.groupby("ItemName", observed=True)
+    views = pd.DataFrame(
+        {
+            "units": grouped["quantity"].sum(),
+            "revenue": grouped["Dollars"].sum(),
+            "weeks_on_sale": grouped["date"].nunique(),
+        }
+    )
+    views["units_per_week"] = views["units"] / views["weeks_on_sale"]
+    return views.sort_values("units", ascending=False)
+
+
+def _store_sales(df):
+    grouped = df.groupby("store_id", observed=True)
+    return pd.DataFrame(
+        {"units": grouped["quantity"].sum(), "revenue": grouped["Dollars"].sum()}
+    ).sort_values("revenue", ascending=False)
+
+
+def _weekly_sales(df):
+    grouped = df.groupby(["year", "week_number"], observed=True)
+    views = pd.DataFrame(
+        {"units": grouped["quantity"].sum(), "revenue": grouped["Dollars"].sum()}
+    )
+    views["revenue_wow_growth_pct"] = views["revenue"].pct_change() * 100
+    return views
+
+
+def _margin_ranking(df):
+    grouped = df.groupby("ItemName", observed=True)
+    return pd.DataFrame(
+        {
+            "mean_margin": grouped["margin"].mean(),
+            "mean_markup": grouped["markup"].mean(),
+        }
+    ).sort_values("mean_margin", ascending=False)
+
+
+def _roi(df):
+    investment = (
+        (df["cost"] * df["quantity"]).groupby(df["ItemName"], observed=True).sum()
+    )
+    revenue = df.groupby("ItemName", observed=True)["Dollars"].sum()
+    views = pd.DataFrame({"revenue": revenue, "investment": investment})
+    views["profit"] = views["revenue"] - views["investment"]
+    views["roi"] = views["profit"] / views["investment"].replace(0, np.nan)
+    return views.sort_values("roi", ascending=False)
+
+
+def _fit(x, y):
+    mask = x.notna() & y.notna()
+    x, y = x[mask].to_numpy(dtype=float), y[mask].to_numpy(dtype=float)
+    if len(x) < 3 or np.ptp(x) == 0:
+        return {
+            "n": len(x),
+            "slope": np.nan,
+            "intercept": np.nan,
+            "correlation": np.nan,
+        }
+    slope, intercept = np.polyfit(x, y, 1)
+    correlation = np.corrcoef(x, y)[0, 1] if np.ptp(y) > 0 else np.nan
+    return {
+        "n": len(x),
+        "slope": slope,
+        "intercept": intercept,
+        "correlation": correlation,
+    }
+
+
+def _discount_regression(df):
+    rows = {"ALL PRODUCTS": _fit(df["discount_percentage"], df["quantity"])}
+    for item, group in df.groupby("ItemName", observed=True):
+        rows[item] = _fit(group["discount_percentage"], group["quantity"])
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+# name -> (columns the view depends on, builder, tool description)
+VIEWS = {
+    "top_sellers": (
+        {"ItemName", "quantity", "Dollars", "date"},
+        _product_sales,
+        "Products ranked by units sold, with revenue, weeks on sale and units per week "
+        "(sales velocity / turnover).",
+    ),
+    "store_sales": (
+        {"store_id", "quantity", "Dollars"},
+        _store_sales,
+        "Units and revenue per store, ranked by revenue.",
+    ),
+    "weekly_sales": (
+        {"year", "week_number", "quantity", "Dollars"},
+        _weekly_sales,
+        "Units and revenue per (year, week_number) with week-over-week revenue growth "
+        "in percent.",
+    ),
+    "margin_ranking": (
+        {"ItemName", "margin", "markup"},
+        _margin_ranking,
+        "Products ranked by mean margin, with mean markup.",
+    ),
+    "roi": (
+        {"ItemName", "cost", "quantity", "Dollars"},
+        _roi,
+        "Return on investment per product: revenue, investment (cost * quantity), "
+        "profit and roi.",
+    ),
+    "discount_regression": (
+        {"ItemName", "discount_percentage", "quantity"},
+        _discount_regression,
+        "Linear regression of units sold on discount_percentage, overall and per "
+        "product (slope, intercept, correlation).",
+    ),
+}
+
+
+class AnalyticsMaterializations:
+    def __init__(self, df, views=None):
+        """
+        Precomputed aggregates for the common analysis questions, built once per loaded
+        frame. Views whose columns are missing from the frame are skipped.
+        """
+        self.df = df
+        self.views = {}
+        if views is None:
+            self.build(VIEWS)
+        else:
+            self.views = views
+
+    def build(self, names):
+        for name in names:
+            columns, builder, _ = VIEWS[name]
+            if columns.issubset(self.df.columns):
+                self.views[name] = builder(self.df)
+            else:
+                self.views.pop(name, None)
+
+    def changed_columns(self, df):
+        """
+        Columns whose values differ in df, or None if the frames are not comparable.
+        """
+        same_columns = list(df.columns) == list(self.df.columns)
+        if not same_columns or not df.index.equals(self.df.index):
+            return None
+        return {
+            column
+            for column in df.columns
+            if df[column] is not self.df[column]
+            and not df[column].equals(self.df[column])
+        }
+
+    def derive(self, df, changed_columns=None):
+        """
+        Returns materializations for a new version of the frame, only rebuilding the
+        views that depend on changed_columns. The current object is left untouched.
+        """
+        if changed_columns is None:
+            changed_columns = self.changed_columns(df)
+        if changed_columns is None:
+            return AnalyticsMaterializations(df)
+        derived = AnalyticsMaterializations(df, dict(self.views))
+        derived.build(
+            name
+            for name, (columns, _, _) in VIEWS.items()
+            if columns & set(changed_columns)
+        )
+        return derived
+
+    def lookup(self, name, top_n=20):
+        """
+        Returns the first top_n rows of the named view as markdown.
+        """
+        if name not in self.views:
+            available = ", ".join(self.views)
+            return f"No precomputed view named {name}. Available views: {available}"
+        return self.views[name].head(top_n).to_markdown()
+
+    def as_tools(self):
+        """
+        Exposes each view as a tool the pandas agent can call in a single step.
+        The optional tool input is the number of rows to return.
+        """
+        from langchain_core.tools import Tool
+
+        def make_lookup(name):
+            def lookup(top_n=""):
+                top_n = str(top_n).strip()
+                return self.lookup(name, int(top_n) if top_n.isdigit() else 20)
+
+            return lookup
+
+        return [
+            Tool(
+                name=name,
+                func=make_lookup(name),
+                description=f"Precomputed: {VIEWS[name][2]} "
+                "Input: number of rows to return.",
+            )
+            for name in self.views
+        ]
@@ -0,0 +1,240 @@
+import hashlib, json, logging, os, re, threading, time
+from collections import OrderedDict
+from datetime import datetime
+
+
+def normalize_text(text):
+    """
+    Normalizes user input so trivially different phrasings share a cache entry.
+    """
+    text = re.sub(r"\s+", " ", str(text)).strip().lower()
+    return text.rstrip("?.! ")
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        path="cache/responses.sqlite",
+        ttl=24 * 60 * 60,
+        max_memory_entries=1024,
+        max_disk_entries=100000,
+        enabled=True,
+    ):
+        """
+        Two tier (memory LRU + SQLite) cache of agent responses shared by all agents.
+        path=None keeps the cache in memory only. ttl is in seconds.
+        Disk errors, e.g. "database is locked" with several processes sharing the file,
+        are logged and treated as misses, so they never fail the query using the cache.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.enabled = enabled
+        self.memory = OrderedDict()  # key -> (created, value)
+        self.lock = threading.RLock()
+        self.engine = None
+        self.table = None
+        self.puts = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def make_key(kind, user_input, model, prompt_version, fingerprint=None, extra=None):
+        """
+        Builds a cache key from the normalized input, model, prompt version and frame
+        fingerprint.
+        """
+        text = normalize_text(user_input)
+        payload = json.dumps(
+            [kind, text, model, prompt_version, fingerprint, extra],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _connect(self):
+        if self.engine is None:
+            from sqlalchemy import Column, Float, MetaData, String, Table, Text
+            from sqlalchemy import create_engine
+
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            engine = create_engine(
+                f"sqlite:///{self.path}", connect_args={"check_same_thread": False}
+            )
+            metadata = MetaData()
+            table = Table(
+                "responses",
+                metadata,
+                Column("key", String(64), primary_key=True),
+                Column("value", Text, nullable=False),
+                Column("created", Float, nullable=False, index=True),
+                Column("accessed", Float, nullable=False, index=True),
+            )
+            # set once the table exists, so a failed attempt is retried on the next call
+            metadata.create_all(engine)
+            self.engine, self.table = engine, table
+        return self.engine
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _remember(self, key, created, value):
+        self.memory[key] = (created, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key, bypass=False):
+        """
+        Returns a copy of the cached response, or None on a miss (or when bypassed).
+        """
+        if bypass or not self.enabled:
+            return None
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and self._expired(entry[0]):
+                del self.memory[key]
+                entry = None
+            if entry is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return json.loads(entry[1])
+
+            if self.path is not None:
+                try:
+                    row = self._disk_get(key)
+                except Exception as e:
+                    self._error(e)
+                    row = None
+                if row is not None:
+                    self._remember(key, row.created, row.value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return json.loads(row.value)
+
+            self.misses += 1
+            return None
+
+    def _error(self, e):
+        self.errors += 1
+        logging.error(f"{datetime.now()} Response Cache Error: {str(e)}")
+
+    def _disk_get(self, key):
+        engine = self._connect()
+        table = self.table
+        with engine.begin() as conn:
+            row = conn.execute(table.select().where(table.c.key == key)).first()
+            if row is None:
+                return None
+            if self._expired(row.created):
+                conn.execute(table.delete().where(table.c.key == key))
+                return None
+            conn.execute(
+                table.update().where(table.c.key == key).values(accessed=time.time())
+            )
+            return row
+
+    def put(self, key, value, bypass=False):
+        """
+        Stores a JSON serializable response in both tiers.
+        """
+        if bypass or not self.enabled:
+            return
+        created = time.time()
+        try:
+            serialized = json.dumps(value)
+        except (TypeError, ValueError) as e:
+            self._error(e)
+            return
+        with self.lock:
+            self._remember(key, created, serialized)
+            if self.path is None:
+                return
+            try:
+                self._disk_put(key, serialized, created)
+            except Exception as e:
+                self._error(e)
+
+    def _disk_put(self, key, serialized, created):
+        from sqlalchemy.dialects.sqlite import insert
+
+        engine = self._connect()
+        statement = insert(self.table).values(
+            key=key, value=serialized, created=created, accessed=created
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=["key"],
+            set_={"value": serialized, "created": created, "accessed": created},
+        )
+        with engine.begin() as conn:
+            conn.execute(statement)
+        self.puts += 1
+        if self.puts % 100 == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Drops expired rows and the least recently used rows over max_disk_entries.
+        """
+        if self.path is None:
+            return
+        from sqlalchemy import func, select
+
+        engine = self._connect()
+        table = self.table
+        with self.lock, engine.begin() as conn:
+            if self.ttl is not None:
+                expired = table.c.created < time.time() - self.ttl
+                conn.execute(table.delete().where(expired))
+            count = conn.execute(select(func.count()).select_from(table)).scalar()
+            if count > self.max_disk_entries:
+                oldest = (
+                    select(table.c.key)
+                    .order_by(table.c.accessed)
+                    .limit(count - self.max_disk_entries)
+                )
+                conn.execute(table.delete().where(table.c.key.in_(oldest)))
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.path is not None:
+                engine = self._connect()
+                with engine.begin() as conn:
+                    conn.execute(self.table.delete())
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "memory_entries": len(self.memory),
+        }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """
+    Process-wide cache shared by IntentAgent, InterfaceAgent and DataframeAnalysisAgent.
+    Configured with NAVSOFT_CACHE (0 disables), NAVSOFT_CACHE_PATH ("" for memory only)
+    and NAVSOFT_CACHE_TTL (seconds).
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            path = os.environ.get("NAVSOFT_CACHE_PATH", "cache/responses.sqlite")
+            _default_cache = ResponseCache(
+                path=path or None,
+                ttl=float(os.environ.get("NAVSOFT_CACHE_TTL", 24 * 60 * 60)),
+                enabled=os.environ.get("NAVSOFT_CACHE", "1") != "0",
+            )
+        return _default_cache
@@ -0,0 +1,287 @@
+import hashlib, threading
+from collections import OrderedDict
+
+from tracing import count_tokens
+
+# column groups of the sales data in priority order, each listing its columns by importance.
+# The summary describes them in this order, so what gets cut to fit the budget is the store
+# details and weather rather than the sales figures. Anything else is listed under "other".
+COLUMN_GROUPS = {
+    "sales": [
+        "Dollars",
+        "quantity",
+        "price",
+        "discount_percentage",
+        "totaldiscount",
+        "promo_price",
+        "Promo_Price",
+        "cost",
+        "margin",
+        "markup",
+        "total_transactions",
+        "total_weeks_on_sale",
+    ],
+    "product": [
+        "ItemName",
+        "BrandName",
+        "Description",
+        "product_category",
+        "size_name",
+        "size_description",
+        "QuantityInCase",
+    ],
+    "time": ["date", "year", "month", "week_number", "day", "month_number"],
+    "ids": ["Item_id", "store_id", "product_upc"],
+    "economy": ["gas_price", "consumer_price_index", "inflation"],
+    "weather": [
+        "average_temperature",
+        "precipitation",
+        "tmin",
+        "tmax",
+        "average_snow",
+        "wspd",
+        "wdir",
+        "wpgt",
+        "pres",
+        "tsun",
+    ],
+    "store": [
+        "company",
+        "company_full_name",
+        "city",
+        "state",
+        "state_code",
+        "street",
+        "zipcode",
+        "latitude",
+        "longitude",
+    ],
+}
+
+# meanings of abbreviated column names
+COLUMN_NOTES = {
+    "tmin": "min temperature",
+    "tmax": "max temperature",
+    "wdir": "wind direction",
+    "wspd": "wind speed",
+    "wpgt": "peak wind gust",
+    "pres": "air pressure",
+    "tsun": "sunshine minutes",
+}
+
+# summaries by (frame fingerprint or version, token budget, model)
+_summaries = OrderedDict()
+_summaries_lock = threading.Lock()
+_MAX_SUMMARIES = 32
+
+# column profiles by column key, shared by the versions of a frame that did not change the column
+_profiles = OrderedDict()
+_MAX_PROFILES = 1024
+
+
+def _short(value, width=30):
+    text = str(value)
+    return text if len(text) <= width else text[: width - 3] + "..."
+
+
+def _count(n, noun):
+    return f"{n} {noun}" if n == 1 else f"{n} {noun}s"
+
+
+def _number(value):
+    return f"{value:.4g}" if isinstance(value, float) else str(value)
+
+
+def column_profile(series, key=None):
+    """
+    (constant, content digest, description line) of a column, where constant is a 1-tuple
+    holding the value of a constant column and None otherwise.
+    Cached by key when given, e.g. the column key of a VersionedFrame.
+    """
+    import pandas as pd
+
+    if key is not None:
+        with _summaries_lock:
+            profile = _profiles.get(key)
+            if profile is not None:
+                _profiles.move_to_end(key)
+                return profile
+    if series.nunique(dropna=False) <= 1:
+        constant = (series.iloc[0] if len(series) else None,)
+        profile = (constant, None, None)
+    else:
+        digest = hashlib.blake2b(
+            pd.util.hash_pandas_object(series, index=False).to_numpy().tobytes(),
+            digest_size=16,
+        ).digest()
+        profile = (None, digest, describe_column(series))
+    if key is not None:
+        with _summaries_lock:
+            _profiles[key] = profile
+            while len(_profiles) > _MAX_PROFILES:
+                _profiles.popitem(last=False)
+    return profile
+
+
+def redundant_columns(df, column_keys=None):
+    """
+    Returns ({constant column: value}, {duplicate column: column it repeats}).
+    """
+    constants, duplicates, seen = {}, {}, {}
+    for column in df.columns:
+        key = column_keys.get(column) if column_keys else None
+        constant, digest, _ = column_profile(df[column], key)
+        if constant is not None:
+            constants[column] = constant[0]
+        elif digest in seen:
+            duplicates[column] = seen[digest]
+        else:
+            seen[digest] = column
+    return constants, duplicates
+
+
+def describe_column(series):
+    """
+    One line per column: dtype, null share and the value range or cardinality with examples.
+    """
+    import pandas as pd
+
+    parts = [str(series.dtype)]
+    nulls = series.isna().mean()
+    if nulls:
+        parts.append(f"{nulls:.0%} null")
+    values = series.dropna()
+    if pd.api.types.is_bool_dtype(series):
+        parts.append(f"{values.mean():.0%} true")
+    elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(
+        series
+    ):
+        if len(values):
+            low, high = values.min(), values.max()
+            if pd.api.types.is_datetime64_any_dtype(series):
+                low, high = low.date(), high.date()
+            parts.append(f"{_number(low)}..{_number(high)}")
+        parts.append(f"{values.nunique()} unique")
+    else:
+        counts = values.astype(str).value_counts()
+        examples = ", ".join(_short(value) for value in counts.index[:3])
+        parts.append(f"{len(counts)} unique, e.g. {examples}")
+    note = COLUMN_NOTES.get(series.name)
+    if note:
+        parts.append(note)
+    return f"{series.name} ({'; '.join(parts)})"
+
+
+def summarize_frame(df, token_budget=600, model=None, sample_rows=3, column_keys=None):
+    """
+    Compact description of df for the agent prompt: grouped columns with their dtypes, ranges
+    and cardinalities, constant and duplicate columns folded into single lines, and a few
+    sample rows if they fit. Columns are described in COLUMN_GROUPS order until token_budget
+    is reached and the rest are listed by name. When even the names do not fit, the constant
+    values, then the constant and duplicate names and then the names of the columns left out
+    are replaced by counts. Only a budget below the header and those counts (about 40
+    tokens) is exceeded.
+    With column_keys ({column: key}) only the columns with new keys are profiled again.
+    """
+    constants, duplicates = redundant_columns(df, column_keys)
+    columns = [c for c in df.columns if c not in constants and c not in duplicates]
+    rank = {
+        column: (i, j)
+        for i, names in enumerate(COLUMN_GROUPS.values())
+        for j, column in enumerate(names)
+    }
+    groups = list(COLUMN_GROUPS) + ["other"]
+    # unknown columns go last, in frame order
+    columns.sort(key=lambda c: rank.get(c, (len(groups) - 1, 0)))
+
+    def cost(line):
+        return count_tokens(line, model) + 1
+
+    # detail of the lines that are always kept, lowered step by step until they fit
+    detail = {"constants": 2, "duplicates": 1, "more": 1}
+    steps = [("constants", 1), ("constants", 0), ("duplicates", 0), ("more", 0)]
+
+    def footer():
+        lines = []
+        if constants and detail["constants"] == 2:
+            values = ", ".join(f"{c}={_short(v)}" for c, v in constants.items())
+            lines.append(f"constant columns: {values}")
+        elif constants and detail["constants"] == 1:
+            lines.append("constant columns: " + ", ".join(constants))
+        elif constants:
+            lines.append(f"{_count(len(constants), 'constant column')}, see df.columns")
+        if duplicates and detail["duplicates"]:
+            pairs = ", ".join(f"{c} (same as {o})" for c, o in duplicates.items())
+            lines.append(f"duplicate columns: {pairs}")
+        elif duplicates:
+            lines.append(
+                f"{_count(len(duplicates), 'duplicate column')}, see df.columns"
+            )
+        return lines
+
+    def more_columns(names):
+        if detail["more"]:
+            return "more columns: " + ", ".join(names)
+        return f"{_count(len(names), 'more column')}, see df.columns"
+
+    index_name = df.index.name or "index"
+    header = (
+        f"df has {len(df)} rows and {len(df.columns)} columns, indexed by {index_name}."
+    )
+
+    def reserved():
+        used = cost(header) + sum(cost(line) for line in footer())
+        return used + (cost(more_columns(columns)) if columns else 0)
+
+    while steps and reserved() > token_budget:
+        name, level = steps.pop(0)
+        detail[name] = level
+
+    # the header, the constant and duplicate lines and the columns left out are always
+    # kept, the column descriptions fill what remains of the budget
+    footer_lines = footer()
+    used = cost(header) + sum(cost(line) for line in footer_lines)
+    described, count, group = [], 0, None
+    for column in columns:
+        key = column_keys.get(column) if column_keys else None
+        line = f"- {column_profile(df[column], key)[2]}"
+        column_group = groups[rank.get(column, (len(groups) - 1, 0))[0]]
+        group_line = f"{column_group}:" if column_group != group else None
+        needed = cost(line) + (cost(group_line) if group_line else 0)
+        rest = columns[count + 1 :]
+        if used + needed + (cost(more_columns(rest)) if rest else 0) > token_budget:
+            break
+        described.extend([group_line, line] if group_line else [line])
+        used += needed
+        count += 1
+        group = column_group
+
+    lines = [header] + described + footer_lines
+    if count < len(columns):
+        lines.append(more_columns(columns[count:]))
+    elif sample_rows:
+        sample = (
+            "sample rows:\n" + df[columns].head(sample_rows).to_csv(index=False).strip()
+        )
+        if used + cost(sample) <= token_budget:
+            lines.append(sample)
+    return "\n".join(lines)
+
+
+def get_summary(key, df, token_budget=600, model=None, column_keys=None):
+    """
+    Summary of the frame identified by key (its fingerprint or version token), computed once
+    per frame, budget and model.
+    """
+    cache_key = (key, token_budget, model)
+    with _summaries_lock:
+        summary = _summaries.get(cache_key)
+        if summary is not None:
+            _summaries.move_to_end(cache_key)
+            return summary
+    summary = summarize_frame(df, token_budget, model, column_keys=column_keys)
+    with _summaries_lock:
+        _summaries[cache_key] = summary
+        while len(_summaries) > _MAX_SUMMARIES:
+            _summaries.popitem(last=False)
+    return summary
@@ -0,0 +1,259 @@
+import os, threading, time, uuid
+from collections import deque
+
+from agent_pool import frame_nbytes
+from intent_agent import IntentAgent
+from versioned_frame import as_versioned
+
+
+class Session:
+    def __init__(
+        self,
+        manager,
+        session_id,
+        gpt4=True,
+        features=None,
+        fast_path=True,
+        history_size=20,
+    ):
+        """
+        Per-user state: the frame being analysed, the forecast features, the model
+        choice and the recent conversation. Created through SessionManager, which owns
+        the frames.
+        """
+        self.manager = manager
+        self.session_id = session_id
+        self.gpt4 = gpt4
+        self.features = features
+        self.agent = IntentAgent(gpt4, fast_path)
+        self.frame = None  # VersionedFrame
+        self.df_key = None
+        self.history = deque(maxlen=history_size)  # {"user_input", "response"} dicts
+        self.created = self.last_used = time.monotonic()
+
+    @property
+    def df(self):
+        return self.frame.df if self.frame is not None else None
+
+    def load_frame(self, df, version=None):
+        """
+        Points the session at a new frame (a DataFrame or a VersionedFrame).
+        The frame may be shared with other sessions, so it must not be modified in place
+        afterwards. Derive a new frame and load that instead.
+        """
+        self.manager.attach_frame(self, df, version)
+
+    def apply_forecast(self, result, columns=None):
+        """
+        Loads the forecast result as a new version of the current frame, storing only
+        the forecasted columns (see VersionedFrame.apply), and returns the new version.
+        """
+        frame = self.frame.apply(result, columns)
+        self.load_frame(frame)
+        return frame
+
+    def params(self, use_cache=True):
+        return {
+            "df": self.frame,
+            "df_version": self.df_key,
+            "features": self.features,
+            "use_cache": use_cache,
+        }
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def record(self, user_input, response):
+        self.touch()
+        self.history.append({"user_input": user_input, "response": response})
+        return response
+
+    def query(self, user_input, use_cache=True):
+        self.touch()
+        response = self.agent.query(user_input, self.params(use_cache))
+        return self.record(user_input, response)
+
+    async def aquery(self, user_input, timeout=None, use_cache=True):
+        self.touch()
+        response = await self.agent.aquery(user_input, self.params(use_cache), timeout)
+        return self.record(user_input, response)
+
+    def stream(self, user_input, use_cache=True):
+        self.touch()
+        for event in self.agent.stream(user_input, self.params(use_cache)):
+            if event["type"] == "final":
+                self.record(user_input, event["result"])
+            yield event
+
+    async def astream(self, user_input, timeout=None, use_cache=True):
+        self.touch()
+        async for event in self.agent.astream(
+            user_input, self.params(use_cache), timeout
+        ):
+            if event["type"] == "final":
+                self.record(user_input, event["result"])
+            yield event
+
+
+class SessionManager:
+    def __init__(self, max_sessions=1000, idle_timeout=30 * 60, max_bytes=None):
+        """
+        Holds the live sessions of a worker process.
+        Sessions idle for longer than idle_timeout seconds are closed, and the least
+        recently used sessions are closed while there are more than max_sessions or
+        their frames take more than max_bytes.
+        Frames with the same content (or version token) are stored once and shared by
+        every session that loads them. Shared frames are never modified, loading a
+        changed frame only repoints the session that loaded it (copy-on-write). Versions
+        of a frame only count the columns they replace, their base frame is counted
+        once.
+        """
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_bytes = max_bytes
+        self.sessions = {}
+        # version -> [VersionedFrame, nbytes, number of sessions using it]
+        self.frames = {}
+        self.bases = {}  # base version -> [nbytes, number of stored versions using it]
+        self.nbytes = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def create(
+        self,
+        session_id=None,
+        df=None,
+        df_version=None,
+        gpt4=True,
+        features=None,
+        fast_path=True,
+    ):
+        """
+        Opens a new session, replacing any existing session with the same id.
+        """
+        session_id = session_id or uuid.uuid4().hex
+        session = Session(self, session_id, gpt4, features, fast_path)
+        with self.lock:
+            self.evict_idle()
+            self.close(session_id)
+            self.sessions[session_id] = session
+            if df is not None:
+                self.attach_frame(session, df, df_version)
+            else:
+                self._evict(keep=session)
+        return session
+
+    def get(self, session_id):
+        """
+        Returns the live session with the id, or None if it was closed or evicted.
+        """
+        with self.lock:
+            self.evict_idle()
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.touch()
+            return session
+
+    def get_or_create(self, session_id, **kwargs):
+        with self.lock:
+            session = self.get(session_id)
+            if session is None:
+                session = self.create(session_id, **kwargs)
+            return session
+
+    def attach_frame(self, session, df, version=None):
+        """
+        Loads df into the session, reusing the stored frame if the same content is
+        already loaded.
+        """
+        frame = as_versioned(df, version)
+        key = frame.version
+        with self.lock:
+            entry = self.frames.get(key)
+            if entry is None:
+                entry = self.frames[key] = [frame, frame.nbytes, 0]
+                self.nbytes += entry[1]
+                base = self.bases.get(frame.base_version)
+                if base is None:
+                    base = [frame_nbytes(frame.base), 0]
+                    self.bases[frame.base_version] = base
+                    self.nbytes += base[0]
+                base[1] += 1
+            entry[2] += 1
+            self._detach_frame(session)
+            session.frame, session.df_key = entry[0], key
+            self._evict(keep=session)
+
+    def _detach_frame(self, session):
+        if session.df_key is None:
+            return
+        entry = self.frames[session.df_key]
+        entry[2] -= 1
+        if entry[2] == 0:
+            del self.frames[session.df_key]
+            self.nbytes -= entry[1]
+            base = self.bases[entry[0].base_version]
+            base[1] -= 1
+            if base[1] == 0:
+                del self.bases[entry[0].base_version]
+                self.nbytes -= base[0]
+        session.frame = session.df_key = None
+
+    def close(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if session is not None:
+                self._detach_frame(session)
+            return session is not None
+
+    def _over_budget(self):
+        return len(self.sessions) > self.max_sessions or (
+            self.max_bytes is not None and self.nbytes > self.max_bytes
+        )
+
+    def _evict(self, keep=None):
+        # the session being created or loaded is kept, even if it alone exceeds the
+        # budget
+        while self._over_budget():
+            victims = [s for s in self.sessions.values() if s is not keep]
+            if not victims:
+                break
+            victim = min(victims, key=lambda s: s.last_used)
+            self.close(victim.session_id)
+            self.evictions += 1
+
+    def evict_idle(self):
+        """
+        Closes the sessions that have been idle for longer than idle_timeout.
+        """
+        if self.idle_timeout is None:
+            return 0
+        cutoff = time.monotonic() - self.idle_timeout
+        with self.lock:
+            idle = [s for s in self.sessions.values() if s.last_used < cutoff]
+            for session in idle:
+                self.close(session.session_id)
+            self.evictions += len(idle)
+            return len(idle)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "sessions": len(self.sessions),
+                "frames": len(self.frames),
+                "base_frames": len(self.bases),
+                "bytes": self.nbytes,
+                "evictions": self.evictions,
+            }
+
+
+# sessions of this worker process
+session_manager = SessionManager(
+    max_sessions=int(os.environ.get("NAVSOFT_MAX_SESSIONS", 1000)),
+    idle_timeout=float(os.environ.get("NAVSOFT_SESSION_IDLE_TIMEOUT", 30 * 60)),
+    max_bytes=(
+        int(os.environ["NAVSOFT_SESSION_MB"]) * 1024 * 1024
+        if "NAVSOFT_SESSION_MB" in os.environ
+        else None
+    ),
+)
@@ -0,0 +1,108 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+DEFAULT_SWEEP = [0, 1, 2, 3, 4, 5]
+SWEEP_COLUMN = "sweep_value"
+
+# set once per worker process by _init_worker so the frame and model are not pickled per point
+_worker_df = None
+_worker_forecast_fn = None
+
+
+def _init_worker(df, forecast_fn):
+    global _worker_df, _worker_forecast_fn
+    _worker_df = df
+    _worker_forecast_fn = forecast_fn
+
+
+def _run_point(feature, value):
+    return value, _worker_forecast_fn(_worker_df, {feature: value})
+
+
+def stack_sweep(df, values):
+    """
+    Stacks one copy of df per sweep value, tagged with the value in SWEEP_COLUMN.
+    """
+    import pandas as pd
+
+    stacked = pd.concat([df] * len(values), ignore_index=True)
+    stacked[SWEEP_COLUMN] = pd.Series(values).repeat(len(df)).to_numpy()
+    return stacked
+
+
+class SimulationEngine:
+    def __init__(
+        self,
+        forecast_fn=None,
+        batch_forecast_fn=None,
+        max_workers=None,
+        metrics=("quantity", "Dollars"),
+    ):
+        """
+        Runs what-if sweeps over a single feature.
+
+        forecast_fn(df, {feature: change}) -> df runs one forecast and is fanned out over a
+        process pool, so it must be picklable (e.g. a module level function).
+        batch_forecast_fn(stacked_df, feature) -> df runs every point in one vectorized call,
+        reading the per-row change from the SWEEP_COLUMN column and keeping it in its output.
+        The batch path is used whenever it is given.
+        """
+        if forecast_fn is None and batch_forecast_fn is None:
+            raise ValueError("A forecast_fn or batch_forecast_fn is required.")
+        self.forecast_fn = forecast_fn
+        self.batch_forecast_fn = batch_forecast_fn
+        self.max_workers = max_workers
+        self.metrics = metrics
+
+    def iter_results(self, df, feature="discount_percentage", values=None):
+        """
+        Yields (value, result_df) for each sweep point as soon as it is finished.
+        Raises ValueError when values is empty.
+        """
+        values = list(DEFAULT_SWEEP if values is None else values)
+        if not values:
+            raise ValueError(f"No values to simulate for {feature}.")
+        if self.batch_forecast_fn is not None:
+            results = self.batch_forecast_fn(stack_sweep(df, values), feature)
+            for value, result in results.groupby(SWEEP_COLUMN, sort=False):
+                yield value, result.drop(columns=SWEEP_COLUMN)
+            return
+
+        max_workers = self.max_workers or min(len(values), os.cpu_count() or 1)
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=(df, self.forecast_fn),
+        ) as executor:
+            futures = [executor.submit(_run_point, feature, value) for value in values]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def summarize(self, feature, results):
+        """
+        Collapses the per-point forecasts into one compact frame (one row per sweep value),
+        small enough to hand to IntentAgent.analyze_results.
+        """
+        import pandas as pd
+
+        rows = []
+        for value, result in results:
+            row = {feature: value, "rows": len(result)}
+            for metric in self.metrics:
+                if metric in result:
+                    row[f"total_{metric}"] = result[metric].sum()
+                    row[f"mean_{metric}"] = result[metric].mean()
+            rows.append(row)
+        return pd.DataFrame(rows).sort_values(feature, ignore_index=True)
+
+    def run(self, df, feature="discount_percentage", values=None, on_result=None):
+        """
+        Runs the whole sweep and returns the summary frame.
+        on_result(value, result_df) is called for each point as it finishes.
+        """
+        results = []
+        for value, result in self.iter_results(df, feature, values):
+            if on_result is not None:
+                on_result(value, result)
+            results.append((value, result))
+        return self.summarize(feature, results)
@@ -0,0 +1,167 @@
+"""
+Stream events are dicts with a "type" key:
+    {"type": "tool", "tool": name, "input": str, "output": str}  a tool call finished
+    {"type": "delta", "text": str}  more of the markdown response field
+    {"type": "final", "result": dict}  the same dict the blocking query returns
+"""
+
+import asyncio, queue, threading
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.output_parsers.json import parse_partial_json
+
+
+class PartialResponse:
+    def __init__(self):
+        """
+        Incrementally parses a streamed {"status", "response"} JSON object and hands out
+        the newly completed part of the response string.
+        """
+        self.reset()
+
+    def reset(self):
+        self.buffer = ""
+        self.sent = ""
+
+    def feed(self, token):
+        self.buffer += token
+        return self.update(self.parse(self.buffer))
+
+    @staticmethod
+    def parse(text):
+        # the model may wrap the object in a ```json fence
+        start = text.find("{")
+        if start < 0:
+            return None
+        text = text[start:]
+        parsed = parse_partial_json(text)
+        if parsed is None and "}" in text:
+            parsed = parse_partial_json(text[: text.rfind("}") + 1])
+        return parsed
+
+    def update(self, partial):
+        """
+        Returns the new suffix of partial["response"], or None if nothing new arrived.
+        """
+        if not isinstance(partial, dict):
+            return None
+        response = partial.get("response")
+        if not isinstance(response, str) or not response.startswith(self.sent):
+            return None
+        delta = response[len(self.sent) :]
+        self.sent = response
+        return delta or None
+
+
+class StreamEventHandler(BaseCallbackHandler):
+    # run inline so tokens reach the stream in order during async runs
+    run_inline = True
+
+    def __init__(self, emit):
+        """
+        Forwards tool results and response deltas of an agent run to emit(event).
+        """
+        self.emit = emit
+        self.response = PartialResponse()
+        self.tools = {}
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.response.reset()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.response.reset()
+
+    def on_llm_new_token(self, token, **kwargs):
+        delta = self.response.feed(token)
+        if delta:
+            self.emit({"type": "delta", "text": delta})
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self.tools[run_id] = ((serialized or {}).get("name", "tool"), input_str)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        name, input_str = self.tools.pop(run_id, ("tool", None))
+        self.emit(
+            {"type": "tool", "tool": name, "input": input_str, "output": str(output)}
+        )
+
+
+def stream_run(run):
+    """
+    Calls run(handler) in a worker thread and yields its stream events as they arrive,
+    followed by {"type": "final", "result": <return value of run>}.
+    """
+    events = queue.Queue()
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = run(StreamEventHandler(events.put))
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            events.put(None)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    while True:
+        event = events.get()
+        if event is None:
+            break
+        yield event
+    thread.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    yield {"type": "final", "result": outcome["result"]}
+
+
+async def astream_run(arun):
+    """
+    Async counterpart of stream_run for a coroutine function arun(handler).
+    The run is cancelled if the consumer stops iterating early.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def emit(event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    task = asyncio.ensure_future(arun(StreamEventHandler(emit)))
+    task.add_done_callback(lambda _: emit(None))
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+        result = task.result()
+    finally:
+        if not task.done():
+            task.cancel()
+    yield {"type": "final", "result": result}
+
+
+def response_deltas(partials):
+    """
+    Turns the growing dicts streamed by a JsonOutputParser chain into delta events,
+    followed by the final event with the last (complete) dict.
+    """
+    response = PartialResponse()
+    last = None
+    for partial in partials:
+        last = partial
+        delta = response.update(partial)
+        if delta:
+            yield {"type": "delta", "text": delta}
+    yield {"type": "final", "result": last}
+
+
+async def aresponse_deltas(partials):
+    response = PartialResponse()
+    last = None
+    async for partial in partials:
+        last = partial
+        delta = response.update(partial)
+        if delta:
+            yield {"type": "delta", "text": delta}
+    yield {"type": "final", "result": last}
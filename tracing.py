@@ -0,0 +1,341 @@
+import bisect, json, logging, os, threading, time
+from collections import defaultdict
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.exceptions import OutputParserException
+
+STAGES = ("intent", "forecast", "analysis")
+DURATION_BUCKETS_MS = (
+    5,
+    10,
+    25,
+    50,
+    100,
+    250,
+    500,
+    1000,
+    2500,
+    5000,
+    10000,
+    30000,
+    60000,
+)
+
+trace_logger = logging.getLogger("navsoft.trace")
+trace_logger.propagate = False
+if os.environ.get("NAVSOFT_TRACE_FILE"):
+    _handler = logging.FileHandler(os.environ["NAVSOFT_TRACE_FILE"], encoding="utf-8")
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.addHandler(_handler)
+    trace_logger.setLevel(logging.INFO)
+
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        cumulative, total = {}, 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            cumulative[str(bound)] = total
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+class Metrics:
+    def __init__(self):
+        """
+        In-process histograms and counters, keyed by (metric name, sorted label items).
+        """
+        self.histograms = defaultdict(Histogram)
+        self.counters = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            self.histograms[(name, tuple(sorted(labels.items())))].observe(value)
+
+    def increment(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def value(self, name, **labels):
+        """
+        Current value of a counter, 0 if it was never incremented.
+        """
+        with self.lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **histogram.snapshot()}
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self.counters.items()
+                ],
+            }
+
+    def render_prometheus(self):
+        """
+        Renders the metrics in the Prometheus text exposition format for scraping.
+        """
+
+        def format_labels(labels, **extra):
+            items = list(labels) + list(extra.items())
+            if not items:
+                return ""
+            return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"navsoft_{name}{format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                for bound, count in histogram.snapshot()["buckets"].items():
+                    lines.append(
+                        f"navsoft_{name}_bucket{format_labels(labels, le=bound)} {count}"
+                    )
+                lines.append(
+                    f"navsoft_{name}_sum{format_labels(labels)} {histogram.sum}"
+                )
+                lines.append(
+                    f"navsoft_{name}_count{format_labels(labels)} {histogram.count}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+_encodings = {}
+
+
+def count_tokens(text, model=None):
+    """
+    Counts tokens with tiktoken, falling back to ~4 characters per token if the encoding
+    cannot be loaded (e.g. offline).
+    """
+    key = model or "cl100k_base"
+    if key not in _encodings:
+        try:
+            import tiktoken
+
+            try:
+                _encodings[key] = tiktoken.encoding_for_model(model)
+            except (KeyError, TypeError):
+                _encodings[key] = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encodings[key] = None
+    encoding = _encodings[key]
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    def __init__(self, metrics=None):
+        """
+        Records a span per chain, model call and tool call, emits each one as a JSON event on
+        the navsoft.trace logger and aggregates durations, tokens, parse failures and retries.
+        """
+        self.metrics = metrics or Metrics()
+        self.spans = {}
+        self.lock = threading.Lock()
+
+    def _start(self, run_id, parent_run_id, kind, name, tags, **fields):
+        stage = next((tag for tag in tags or () if tag in STAGES), None)
+        with self.lock:
+            if stage is None and parent_run_id in self.spans:
+                stage = self.spans[parent_run_id]["stage"]
+            self.spans[run_id] = {
+                "kind": kind,
+                "name": name,
+                "stage": stage,
+                "run_id": str(run_id),
+                "parent_run_id": str(parent_run_id) if parent_run_id else None,
+                "start": time.time(),
+                **fields,
+            }
+
+    def _end(self, run_id, error=None, **fields):
+        with self.lock:
+            span = self.spans.pop(run_id, None)
+        if span is None:
+            return
+        span.update(fields)
+        span["duration_ms"] = (time.time() - span["start"]) * 1000
+        if error is not None:
+            span["error"] = f"{type(error).__name__}: {error}"
+            self.metrics.increment(
+                "errors_total", stage=span["stage"], kind=span["kind"]
+            )
+        self.metrics.observe(
+            "span_duration_ms",
+            span["duration_ms"],
+            stage=span["stage"],
+            kind=span["kind"],
+        )
+        if span["kind"] == "tool":
+            self.metrics.observe(
+                "tool_duration_ms", span["duration_ms"], tool=span["name"]
+            )
+        trace_logger.info(json.dumps(span, default=str))
+
+    @staticmethod
+    def _name(serialized, kwargs):
+        if kwargs.get("name"):
+            return kwargs["name"]
+        serialized = serialized or {}
+        return serialized.get("name") or (serialized.get("id") or ["unknown"])[-1]
+
+    def on_chain_start(
+        self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, **kwargs
+    ):
+        self._start(
+            run_id, parent_run_id, "chain", self._name(serialized, kwargs), tags
+        )
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        with self.lock:
+            span = self.spans.get(run_id, {})
+        # only count the failure on the parser's own span, not on every enclosing chain
+        if isinstance(error, OutputParserException) and "Parser" in str(
+            span.get("name")
+        ):
+            self.metrics.increment("parse_failures_total", stage=span.get("stage"))
+        self._end(run_id, error)
+
+    def _model_start(self, serialized, prompt, run_id, parent_run_id, tags, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = (
+            params.get("model")
+            or params.get("model_name")
+            or self._name(serialized, {})
+        )
+        prompt_tokens = count_tokens(prompt, model)
+        self._start(
+            run_id,
+            parent_run_id,
+            "llm",
+            model,
+            tags,
+            model=model,
+            prompt_tokens=prompt_tokens,
+        )
+
+    def on_chat_model_start(
+        self, serialized, messages, *, run_id, parent_run_id=None, tags=None, **kwargs
+    ):
+        prompt = "\n".join(str(m.content) for batch in messages for m in batch)
+        self._model_start(serialized, prompt, run_id, parent_run_id, tags, kwargs)
+
+    def on_llm_start(
+        self, serialized, prompts, *, run_id, parent_run_id=None, tags=None, **kwargs
+    ):
+        self._model_start(
+            serialized, "\n".join(prompts), run_id, parent_run_id, tags, kwargs
+        )
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self.lock:
+            span = self.spans.get(run_id, {})
+        model = span.get("model")
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", span.get("prompt_tokens", 0))
+        completion_tokens = usage.get("completion_tokens")
+        if completion_tokens is None:
+            texts = []
+            for generations in response.generations:
+                for generation in generations:
+                    texts.append(generation.text)
+                    message = getattr(generation, "message", None)
+                    if message is not None and message.additional_kwargs.get(
+                        "function_call"
+                    ):
+                        texts.append(
+                            json.dumps(message.additional_kwargs["function_call"])
+                        )
+            completion_tokens = count_tokens("".join(texts), model)
+        self.metrics.increment(
+            "tokens_total", prompt_tokens, model=model, type="prompt"
+        )
+        self.metrics.increment(
+            "tokens_total", completion_tokens, model=model, type="completion"
+        )
+        self._end(
+            run_id, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(
+        self, serialized, input_str, *, run_id, parent_run_id=None, tags=None, **kwargs
+    ):
+        self._start(
+            run_id,
+            parent_run_id,
+            "tool",
+            self._name(serialized, kwargs),
+            tags,
+            input=input_str,
+        )
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, output_chars=len(str(output)))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        with self.lock:
+            stage = self.spans.get(run_id, {}).get("stage")
+        self.metrics.increment("retries_total", stage=stage)
+        trace_logger.info(
+            json.dumps(
+                {
+                    "kind": "retry",
+                    "run_id": str(run_id),
+                    "stage": stage,
+                    "attempt": retry_state.attempt_number,
+                }
+            )
+        )
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """
+    Process-wide tracing handler shared by every agent.
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = TracingCallbackHandler()
+        return _tracer
+
+
+def trace_config(stage, callbacks=()):
+    """
+    Runnable config that attaches the tracer (plus any extra callbacks) and tags every span
+    with the stage. Set NAVSOFT_TRACING=0 to disable tracing.
+    """
+    callbacks = list(callbacks)
+    if os.environ.get("NAVSOFT_TRACING", "1") != "0":
+        callbacks.append(get_tracer())
+    return {"callbacks": callbacks, "tags": [stage]}
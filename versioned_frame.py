@@ -0,0 +1,112 @@
+import hashlib
+
+from agent_pool import frame_fingerprint
+
+
+def column_token(series):
+    """
+    Content hash of a single column (values and dtype, not the index).
+    """
+    import pandas as pd
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(series.dtype).encode())
+    digest.update(pd.util.hash_pandas_object(series, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class VersionedFrame:
+    def __init__(self, base, version=None, df=None, overlays=None):
+        """
+        A base frame plus the columns that forecasts replaced (or added) on top of it.
+        Every version shares the unchanged columns with the base, so a session holding dozens
+        of what-if versions stays close to one copy of the data. Create versions with apply.
+
+        df is the materialized frame handed to the agents. It shares its memory with the base
+        and the other versions and, like every frame loaded into a session, must not be
+        modified in place.
+        """
+        self.base = base
+        self.base_version = version if version is not None else frame_fingerprint(base)
+        self.df = base if df is None else df
+        self.overlays = dict(overlays or {})  # column -> column_token of its values
+        if self.overlays:
+            digest = hashlib.blake2b(digest_size=8)
+            digest.update(repr(sorted(self.overlays.items())).encode())
+            self.version = f"{self.base_version}+{digest.hexdigest()}"
+        else:
+            self.version = self.base_version
+
+    def apply(self, result, columns=None):
+        """
+        Returns a new version with the columns of result (a frame or a {column: values} dict
+        aligned with the base rows) applied on top of this one, e.g. the predicted quantity
+        and Dollars of a forecast. Without columns, only the columns of result whose values
+        differ from this version are kept, so a full forecast frame can be passed as is.
+        This version is left untouched.
+        """
+        import pandas as pd
+
+        if columns is None:
+            columns = [
+                column
+                for column in result
+                if column not in self.df or not self.df[column].equals(result[column])
+            ]
+        df = self.df.copy(deep=False)
+        overlays = dict(self.overlays)
+        for column in columns:
+            values = result[column]
+            if isinstance(values, pd.Series):
+                if not values.index.equals(df.index):
+                    raise ValueError(
+                        f"Column {column} is not aligned with the rows of the base frame."
+                    )
+            elif len(values) != len(df):
+                raise ValueError(
+                    f"Column {column} has {len(values)} values for {len(df)} rows."
+                )
+            # assigning copies just this column, so the result frame is not kept alive
+            df[column] = values
+            overlays[column] = column_token(df[column])
+        return VersionedFrame(self.base, self.base_version, df, overlays)
+
+    def changed_columns(self, other):
+        """
+        Columns whose values differ from other, or None if the versions have different bases.
+        """
+        if other is None or other.base_version != self.base_version:
+            return None
+        return {
+            column
+            for column in set(self.overlays) | set(other.overlays)
+            if self.overlays.get(column) != other.overlays.get(column)
+        }
+
+    def column_keys(self):
+        """
+        Content key of every column, shared by the versions in which the column is unchanged.
+        """
+        return {
+            column: (column, self.overlays.get(column, self.base_version))
+            for column in self.df.columns
+        }
+
+    @property
+    def nbytes(self):
+        """
+        Memory this version adds on top of the base frame.
+        """
+        return int(
+            sum(
+                self.df[column].memory_usage(index=False, deep=True)
+                for column in self.overlays
+            )
+        )
+
+
+def as_versioned(df, version=None):
+    """
+    Wraps a plain frame as the base version, VersionedFrames are returned as is.
+    """
+    return df if isinstance(df, VersionedFrame) else VersionedFrame(df, version)